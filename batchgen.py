@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from dotenv import load_dotenv
+import metrics
+import storage
+import preprompt as pp
+from export import export_rows, EXPORT_FORMATS
+from revgen import init_client, close_client, compile_prompt, save_reviews, if_windows, MAX_TOKENS, PROMPT_LAYOUT
+from scenarios import parse_all_scenarios, FALLBACK_SCENARIO
+from wbparser import get_product_info, open_session, close_session
+
+# Загрузка переменных окружения
+load_dotenv()
+
+DB_PATH = os.getenv('DB_PATH')
+
+# Как часто проверять состояние пакетного задания OpenAI, сек.
+BATCH_POLL_INTERVAL = float(os.getenv('BATCH_POLL_INTERVAL', 60))
+
+# Сценарий покупки запрашивается один раз на группу покупателей из одного кластера (модель придумывает 10 сценариев)
+SCENARIOS_PER_REQUEST = 10
+
+# Состояния пакетного задания OpenAI, после которых оно уже не изменится
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Этапы генерации: сначала пакет запросов сценариев, затем пакет запросов отзывов
+STAGES = ('situations', 'reviews')
+
+# Запрос к модели в формате строки входного файла Batch API
+def make_request(custom_id, prompt, model_name):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": MAX_TOKENS,
+            "temperature": 1
+        }
+    }
+
+# Входной файл пакетного задания (JSONL: по одному запросу в строке)
+def to_jsonl(requests):
+    return ''.join(json.dumps(request, ensure_ascii=False) + '\n' for request in requests).encode('utf-8')
+
+# Разбор выходного файла пакетного задания: custom_id -> текст ответа (None, если запрос не выполнен)
+def parse_output(text):
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get('response') or {}
+        if response.get('status_code') != 200:
+            metrics.inc('batch_request_failures')
+            results[item['custom_id']] = None
+            continue
+        body = response['body']
+        usage = body.get('usage') or {}
+        metrics.inc('batch_prompt_tokens', usage.get('prompt_tokens', 0))
+        metrics.inc('batch_completion_tokens', usage.get('completion_tokens', 0))
+        results[item['custom_id']] = body['choices'][0]['message']['content']
+    return results
+
+# Запросы сценариев: один запрос на каждые 10 покупателей из одного кластера
+def situation_requests(state, template):
+    personas = state['personas']
+    clusters = defaultdict(list)
+    for index, persona in enumerate(personas):
+        clusters[pp.persona_cluster(*persona)].append(index)
+
+    requests = []
+    groups = {}
+    for indices in clusters.values():
+        for start in range(0, len(indices), SCENARIOS_PER_REQUEST):
+            group = indices[start:start + SCENARIOS_PER_REQUEST]
+            custom_id = f"situation-{group[0]}"
+            # Промпт содержит только поля кластера, поэтому сценарии подходят всем покупателям группы
+            requests.append(make_request(custom_id, template.cluster_situation_prompt(*personas[group[0]]), state['model']))
+            groups[custom_id] = group
+    state['groups'] = groups
+    return requests
+
+# Распределение полученных сценариев между покупателями и выбор типа отзыва для каждого из них
+# При заданном seed сценарии перемешиваются воспроизводимо (seed запуска и артикул, как и при выборе покупателей)
+def assign_situations(state, results, product_name):
+    seed = state.get('seed')
+    rng = random.Random(f"{seed}:{state['product_id']}") if seed is not None else random.Random()
+    contexts = [None] * len(state['personas'])
+    for custom_id, group in state['groups'].items():
+        scenarios = parse_all_scenarios(results.get(custom_id) or '')
+        rng.shuffle(scenarios)
+        for position, index in enumerate(group):
+            situation = scenarios[position] if position < len(scenarios) else FALLBACK_SCENARIO
+            review_type, rating = pp.get_review_type(product_name, state['rating_preference'])
+            contexts[index] = {'situation': situation, 'review_type': review_type, 'rating': rating, 'emoji': pp.use_emoji()}
+    state['contexts'] = contexts
+
+# Запросы отзывов по выбранным сценариям
+def review_requests(state, template):
+    requests = []
+    for index, (persona, context) in enumerate(zip(state['personas'], state['contexts'])):
+        prompt = template.render(
+            pp.get_reviewer_profile(*persona),
+            pp.get_situation(context['situation'], template.product_name),
+            context['review_type'],
+            context['emoji'],
+        )
+        requests.append(make_request(f"review-{index}", prompt, state['model']))
+    return requests
+
+# Запись полученных отзывов в бд (повторная запись тех же отзывов ничего не меняет), возвращает число полученных отзывов
+async def store_reviews(id_gen, state, results):
+    review_records = []
+    for index, (persona, context) in enumerate(zip(state['personas'], state['contexts'])):
+        review = results.get(f"review-{index}")
+        if review is None:
+            continue
+        sex, profession, income, marital_status, children, hobby = persona
+        review_records.append((id_gen, index + 1, review, context['rating'], context['situation'],
+                               sex, profession, marital_status, children, hobby))
+    await save_reviews(review_records, raise_errors=True)
+    metrics.inc('batch_reviews_received', len(review_records))
+    return len(review_records)
+
+async def load_job(id_batch):
+    row = await storage.fetchone("SELECT id_gen, stage, openai_batch_id, state FROM batch_jobs WHERE id_batch = ?", (id_batch,))
+    id_gen, stage, openai_batch_id, state = row
+    return id_gen, stage, openai_batch_id, json.loads(state)
+
+async def save_job(id_batch, stage, openai_batch_id, state):
+    await storage.write(
+        "UPDATE batch_jobs SET stage = ?, openai_batch_id = ?, state = ?, updated_at = ? WHERE id_batch = ?",
+        (stage, openai_batch_id, json.dumps(state, ensure_ascii=False), time.time(), id_batch))
+
+async def submit(client, id_batch, stage, requests):
+    """Асинхронная функция для загрузки входного файла и создания пакетного задания OpenAI (возвращает его id)."""
+
+    input_file = await client.files.create(file=(f"batch_{id_batch}_{stage}.jsonl", to_jsonl(requests)), purpose='batch')
+    batch = await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint='/v1/chat/completions',
+        completion_window='24h',
+        metadata={'id_batch': str(id_batch), 'stage': stage},
+    )
+    metrics.inc('batch_jobs_submitted')
+    metrics.inc('batch_requests_submitted', len(requests))
+    print(f"Пакет {id_batch}: отправлено запросов этапа {stage}: {len(requests)} (задание {batch.id})")
+    return batch.id
+
+async def advance(id_batch):
+    """Асинхронная функция, продвигающая генерацию на столько этапов, на сколько возможно без ожидания.
+
+    Все промежуточные данные хранятся в таблице batch_jobs, поэтому после перезапуска
+    генерация продолжается с того же места. Возвращает текущий этап ('done' и 'failed' - итоговые).
+    """
+
+    client = await init_client()
+    while True:
+        id_gen, stage, openai_batch_id, state = await load_job(id_batch)
+        if stage not in STAGES:
+            return stage
+        template = compile_prompt(state['product_data'], state['layout'])
+
+        if openai_batch_id is None:
+            requests = situation_requests(state, template) if stage == 'situations' else review_requests(state, template)
+            # Состояние с группами запросов сохраняется до отправки, чтобы ответы можно было сопоставить после перезапуска
+            await save_job(id_batch, stage, None, state)
+            openai_batch_id = await submit(client, id_batch, stage, requests)
+            await save_job(id_batch, stage, openai_batch_id, state)
+            return stage
+
+        batch = await client.batches.retrieve(openai_batch_id)
+        if batch.status not in FINAL_STATUSES:
+            return stage
+        # У просроченного задания может быть файл с частью ответов, они тоже используются
+        if batch.status == 'failed' or batch.output_file_id is None:
+            print(f"Пакет {id_batch}: задание {openai_batch_id} завершилось со статусом {batch.status}")
+            metrics.inc('batch_jobs_failed')
+            await save_job(id_batch, 'failed', openai_batch_id, state)
+            return 'failed'
+
+        output = await client.files.content(batch.output_file_id)
+        results = parse_output(output.text)
+        if stage == 'situations':
+            assign_situations(state, results, template.product_name)
+            await save_job(id_batch, 'reviews', None, state)
+        else:
+            # Этап завершается только после записи отзывов: при ошибке запись повторяется при следующей проверке
+            # (или после перезапуска с --resume), пока выходной файл задания еще доступен
+            try:
+                received = await store_reviews(id_gen, state, results)
+            except Exception:
+                metrics.inc('batch_store_failures')
+                return stage
+            print(f"Пакет {id_batch}: получено отзывов {received} из {len(state['personas'])}")
+            await save_job(id_batch, 'done', openai_batch_id, state)
+
+async def wait_for(id_batch, poll_interval=BATCH_POLL_INTERVAL):
+    """Асинхронная функция, ожидающая завершения генерации (возвращает итоговый этап)."""
+
+    while True:
+        stage = await advance(id_batch)
+        if stage not in STAGES:
+            return stage
+        await asyncio.sleep(poll_interval)
+
+async def start_batch_generation(product_id, num_reviews, model_name='gpt-4o-mini', rating_preference='balanced',
+                                 gender_preference=None, user_id=None, seed=None):
+    """Асинхронная функция для запуска пакетной генерации отзывов на товар (возвращает id_batch или None)."""
+
+    product_data = await get_product_info(product_id)
+    if not product_data:
+        print(f"Не удалось получить данные о товаре {product_id}")
+        return None
+
+    result = await storage.write("""
+        INSERT INTO generation (id_user, id_product, model, rating_pref, num_reviews) VALUES (?, ?, ?, ?, ?)
+    """, (user_id, product_id, model_name, rating_preference, num_reviews))
+    id_gen = result.lastrowid
+
+    state = {
+        'product_id': product_id,
+        'product_data': product_data,
+        'model': model_name,
+        'rating_preference': rating_preference,
+        'layout': PROMPT_LAYOUT,
+        'seed': seed,
+        'personas': [list(persona) for persona in pp.sample_personas(num_reviews, gender_preference, seed)],
+    }
+    now = time.time()
+    result = await storage.write("""
+        INSERT INTO batch_jobs (id_gen, stage, state, created_at, updated_at) VALUES (?, 'situations', ?, ?, ?)
+    """, (id_gen, json.dumps(state, ensure_ascii=False), now, now))
+    id_batch = result.lastrowid
+    await advance(id_batch)
+    return id_batch
+
+async def unfinished_batches():
+    rows = await storage.fetchall("SELECT id_batch FROM batch_jobs WHERE stage IN ('situations', 'reviews') ORDER BY id_batch")
+    return [id_batch for id_batch, in rows]
+
+async def export_batch(id_batch, path):
+    """Асинхронная функция для выгрузки отзывов пакетной генерации в файл (формат определяется расширением)."""
+
+    id_gen, _, _, state = await load_job(id_batch)
+    rows = await storage.fetchall("SELECT num_review, review, rating, sex FROM reviews WHERE id_gen = ? ORDER BY num_review", (id_gen,))
+    output = export_rows([
+        {'id_gen': id_gen, 'product_id': state['product_id'], 'num_review': num_review, 'review': review, 'rating': rating, 'sex': sex}
+        for num_review, review, rating, sex in rows
+    ], os.path.splitext(path)[1].lstrip('.'))
+    if output is not None:
+        with open(path, 'wb') as file:
+            file.write(output.getvalue())
+        print(f"Отзывы сохранены в файл {path}")
+
+async def main(args):
+    try:
+        await storage.open_db(DB_PATH)
+        await init_client()
+        await open_session()
+        if args.resume:
+            id_batches = await unfinished_batches()
+            print(f"Незавершенных пакетов: {len(id_batches)}")
+        else:
+            id_batch = await start_batch_generation(args.article, args.num, args.model, args.rating, args.gender, seed=args.seed)
+            id_batches = [] if id_batch is None else [id_batch]
+        if args.no_wait:
+            return
+        stages = await asyncio.gather(*(wait_for(id_batch, args.poll_interval) for id_batch in id_batches))
+        for id_batch, stage in zip(id_batches, stages):
+            if stage == 'done' and args.output:
+                await export_batch(id_batch, args.output if len(id_batches) == 1 else f"{id_batch}_{args.output}")
+    finally:
+        await close_client()
+        await close_session()
+        await storage.close_db()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Пакетная генерация отзывов через OpenAI Batch API")
+    parser.add_argument('article', nargs='?', help="Артикул товара")
+    parser.add_argument('--num', type=int, default=100, help="Количество отзывов")
+    parser.add_argument('--model', default='gpt-4o-mini', help="Модель OpenAI")
+    parser.add_argument('--rating', default='balanced', choices=['balanced', 'positive', 'neutral', 'negative'])
+    parser.add_argument('--gender', default=None, choices=['мужчина', 'женщина'])
+    parser.add_argument('--seed', type=int, default=None, help="Seed для воспроизводимого выбора покупателей")
+    parser.add_argument('--output', default=None, help=f"Файл для выгрузки отзывов ({', '.join(EXPORT_FORMATS)})")
+    parser.add_argument('--resume', action='store_true', help="Продолжить незавершенные пакетные генерации")
+    parser.add_argument('--no-wait', action='store_true', help="Только отправить задание, не дожидаясь результата")
+    parser.add_argument('--poll-interval', type=float, default=BATCH_POLL_INTERVAL)
+    args = parser.parse_args()
+    if not args.resume and not args.article:
+        parser.error("Укажите артикул товара или --resume")
+
+    if_windows()
+    asyncio.run(main(args))
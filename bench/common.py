@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+# Общие функции замеров производительности: запуск локальных заглушек, параллельные запросы и перцентили.
+# Скрипты замеров запускаются из корня проекта (python bench/<замер>.py) и импортируют этот модуль первым,
+# чтобы модули бота были доступны для импорта
+
+import asyncio
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def int_arg(position, default):
+    """Функция возвращает целочисленный аргумент командной строки с номером position или значение по умолчанию."""
+    return int(sys.argv[position]) if len(sys.argv) > position else default
+
+@asynccontextmanager
+async def stub_servers(*servers):
+    """Асинхронный контекстный менеджер для запуска заглушек (пары aiohttp-приложение, порт) на 127.0.0.1."""
+
+    runners = []
+    try:
+        for app, port in servers:
+            runner = web.AppRunner(app)
+            runners.append(runner)
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', port).start()
+        yield
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+async def run_concurrently(count, in_flight, request):
+    """Асинхронная функция для выполнения request(номер) count раз, не более in_flight одновременно.
+
+    Возвращает общее время выполнения и список длительностей отдельных запросов (в секундах).
+    """
+
+    semaphore = asyncio.Semaphore(in_flight)
+    latencies = []
+
+    async def timed(number):
+        async with semaphore:
+            started = time.perf_counter()
+            await request(number)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(number) for number in range(count)))
+    return time.perf_counter() - started, latencies
+
+def percentile(values, q):
+    """Функция для получения перцентиля q (от 0 до 100) по списку замеров (так же, как metrics.percentile)."""
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+def latency_summary(latencies):
+    """Функция возвращает строку с p50 и p99 длительностей в миллисекундах."""
+    return f"p50 {percentile(latencies, 50) * 1000:.1f} мс, p99 {percentile(latencies, 99) * 1000:.1f} мс"
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# Сравнение скорости записи: отдельное соединение и commit на каждый запрос (как было до storage.py)
+# и общий писатель с групповой фиксацией, когда запросы поступают от многих генераций одновременно.
+# Запуск: python bench/db_writes.py [число генераций, 50] [отзывов в генерации, 10]
+
+import asyncio
+import os
+import tempfile
+import time
+from common import int_arg
+import aiosqlite
+import metrics
+from database import migrate
+from storage import Database
+
+GENERATIONS = int_arg(1, 50)
+REVIEWS = int_arg(2, 10)
+SQL = "INSERT INTO reviews (id_gen, num_review, review, rating) VALUES (?, ?, ?, ?)"
+
+def review_rows(id_gen):
+    return [(id_gen, num_review, 'Отличный товар, пришел быстро. ' * 20, 5) for num_review in range(1, REVIEWS + 1)]
+
+async def per_connection(path):
+    semaphore = asyncio.Semaphore(16)
+
+    async def save(id_gen):
+        async with semaphore:
+            async with aiosqlite.connect(path) as conn:
+                await conn.execute("PRAGMA busy_timeout=5000")
+                await conn.executemany(SQL, review_rows(id_gen))
+                await conn.commit()
+
+    await asyncio.gather(*(save(id_gen) for id_gen in range(1, GENERATIONS + 1)))
+    return GENERATIONS
+
+async def group_commit(path):
+    commits = metrics.counters['db_commits']
+    db = Database(path)
+    await db.open()
+    try:
+        await asyncio.gather(*(db.write_many(SQL, review_rows(id_gen)) for id_gen in range(1, GENERATIONS + 1)))
+    finally:
+        await db.close()
+    return metrics.counters['db_commits'] - commits
+
+async def main():
+    for name, run in (('отдельные соединения', per_connection), ('групповая фиксация', group_commit)):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.db')
+            migrate(path)
+            async with aiosqlite.connect(path) as conn:
+                await conn.execute("PRAGMA journal_mode=WAL")
+            started = time.perf_counter()
+            commits = await run(path)
+            elapsed = time.perf_counter() - started
+            print(f"{name}: {GENERATIONS * REVIEWS / elapsed:.0f} вставок/сек., commit: {commits}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# Замер времени и пикового потребления памяти при выгрузке типичной генерации (10 отзывов) в каждом формате.
+# Запуск: python bench/export_formats.py [число отзывов, 10]
+
+import time
+import tracemalloc
+from common import int_arg
+from export import EXPORT_FORMATS, export_rows
+
+NUM_REVIEWS = int_arg(1, 10)
+
+def main():
+    sample_rows = [
+        {'id_gen': 1, 'product_id': 123456, 'num_review': i, 'review': 'Отличный товар, пришел быстро. ' * 20, 'rating': 5, 'sex': 'женщина'}
+        for i in range(1, NUM_REVIEWS + 1)
+    ]
+    for format_type in EXPORT_FORMATS:
+        export_rows(sample_rows, format_type)
+        repeats = 20 if format_type == 'xlsx' else 1000
+        started = time.perf_counter()
+        for _ in range(repeats):
+            export_rows(sample_rows, format_type)
+        elapsed = (time.perf_counter() - started) / repeats
+        tracemalloc.start()
+        size = len(export_rows(sample_rows, format_type).getvalue())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{format_type}: {elapsed * 1e6:.0f} мкс, пик памяти {peak / 1024:.0f} КБ, размер файла {size} байт")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# Проверка общего клиента OpenAI на локальной заглушке API: сравнение с созданием клиента на каждый запрос.
+# Заглушка считает новые TCP-соединения по адресу клиента, поэтому оба варианта замеряются одинаково.
+# Запуск: python bench/openai_client.py [число запросов, 500] [одновременно, 50]
+
+import asyncio
+import os
+import time
+from common import int_arg, run_concurrently, stub_servers
+from aiohttp import web
+import openai
+from revgen import close_client, create_completion, get_pool_stats, init_client
+
+NUM_REQUESTS = int_arg(1, 500)
+IN_FLIGHT = int_arg(2, 50)
+STUB_PORT = 8765
+STUB_DELAY = 0.02
+
+peers = set()
+
+async def stub_completion(request):
+    peers.add(request.transport.get_extra_info('peername'))
+    body = await request.json()
+    await asyncio.sleep(STUB_DELAY)
+    return web.json_response({
+        'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'Отличный товар'}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 10, 'completion_tokens': 3, 'total_tokens': 13},
+    })
+
+async def per_request_client(number):
+    async with openai.AsyncClient(api_key='stub', max_retries=0) as client:
+        await create_completion(client, f"Промпт {number}", 'gpt-4o-mini')
+
+async def shared_client(number):
+    await create_completion(await init_client(), f"Промпт {number}", 'gpt-4o-mini')
+
+async def main():
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{STUB_PORT}/v1'
+    os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    stub = web.Application()
+    stub.router.add_post('/v1/chat/completions', stub_completion)
+    async with stub_servers((stub, STUB_PORT)):
+        try:
+            for name, request in (('клиент на каждый запрос', per_request_client), ('общий клиент с пулом', shared_client)):
+                peers.clear()
+                elapsed, _ = await run_concurrently(NUM_REQUESTS, IN_FLIGHT, request)
+                print(f"{name}: {NUM_REQUESTS / elapsed:.0f} запросов/сек., новых соединений {len(peers)}, "
+                      f"доля переиспользованных {1 - len(peers) / NUM_REQUESTS:.0%}")
+            print(f"Статистика общего пула: {get_pool_stats()}")
+        finally:
+            await close_client()
+
+if __name__ == '__main__':
+    asyncio.run(main())
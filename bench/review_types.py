@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Микробенчмарк выбора 100 тыс. типов отзывов: прежний способ (словарь всех шаблонов с названием товара
+# собирается и фильтруется при каждом вызове) и индекс, построенный при импорте модуля preprompt.
+# Запуск: python bench/review_types.py [число выборов, 100000]
+
+import random
+import time
+from collections import Counter
+from common import int_arg
+from preprompt import BALANCED_CUM_WEIGHTS, BALANCED_RATINGS, REVIEW_TYPES, get_review_type
+
+SAMPLES = int_arg(1, 100_000)
+PRODUCT_NAME = 'Чайник электрический'
+PREFERENCE_FILTERS = {
+    'positive': lambda rating: rating >= 4,
+    'neutral': lambda rating: rating == 3,
+    'negative': lambda rating: rating <= 2,
+}
+
+# Части шаблонов между подстановками названия товара: их склейка по стоимости близка к прежним f-строкам
+TEMPLATE_PARTS = {key: (template.split('{product_name}'), rating) for key, (template, rating) in REVIEW_TYPES.items()}
+
+def get_review_type_rebuilt(product_name, rating_preference):
+    type_variations = {key: (product_name.join(parts), rating) for key, (parts, rating) in TEMPLATE_PARTS.items()}
+    if rating_preference == 'balanced':
+        chosen_rating = random.choices(BALANCED_RATINGS, cum_weights=BALANCED_CUM_WEIGHTS, k=1)[0]
+        filtered_types = {key: val for key, val in type_variations.items() if val[1] == chosen_rating}
+    else:
+        filtered_types = {key: val for key, val in type_variations.items() if PREFERENCE_FILTERS[rating_preference](val[1])}
+    return filtered_types[random.choice(list(filtered_types))]
+
+def main():
+    for rating_preference in ('balanced', 'positive', 'neutral', 'negative'):
+        timings = []
+        for function in (get_review_type_rebuilt, get_review_type):
+            started = time.perf_counter()
+            for _ in range(SAMPLES):
+                function(PRODUCT_NAME, rating_preference)
+            timings.append(time.perf_counter() - started)
+        print(f"{rating_preference}: {timings[0]:.2f} сек. -> {timings[1]:.2f} сек.")
+
+    # Распределение рейтингов в сбалансированном режиме (ожидается 0.5%, 1.5%, 3%, 10%, 85%)
+    ratings = Counter(get_review_type(PRODUCT_NAME, 'balanced')[1] for _ in range(SAMPLES))
+    print("Рейтинги (balanced): " + ", ".join(f"{rating}: {ratings[rating] / SAMPLES:.1%}" for rating in BALANCED_RATINGS))
+
+if __name__ == '__main__':
+    main()
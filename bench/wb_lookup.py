@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Замер времени получения карточки и цены на локальной заглушке серверов Wildberries:
+# новая сессия на каждый запрос (как было раньше) и общая сессия с пулом соединений.
+# Запуск: python bench/wb_lookup.py [число запросов, 1000] [одновременно, WB_POOL_PER_HOST]
+
+import asyncio
+from common import int_arg, latency_summary, run_concurrently, stub_servers
+import aiohttp
+from aiohttp import web
+from wbparser import WB_POOL_PER_HOST, close_session, get_card_info, open_session
+
+NUM_LOOKUPS = int_arg(1, 1000)
+IN_FLIGHT = int_arg(2, WB_POOL_PER_HOST)
+# Карточка и цена отдаются разными серверами (у каждого свой лимит WB_POOL_PER_HOST), как и у Wildberries
+CARD_PORT, PRICE_PORT = 8766, 8767
+MOCK_DELAY = 0.005
+FIRST_ARTICLE = 10000000
+
+async def mock_card(request):
+    await asyncio.sleep(MOCK_DELAY)
+    return web.json_response({
+        'nm_id': int(request.match_info['id']), 'imt_name': 'Чайник электрический', 'subj_root_name': 'Бытовая техника',
+        'subj_name': 'Чайники', 'description': 'Чайник из нержавеющей стали. ' * 20,
+        'options': [{'name': 'Объем', 'value': '1.7 л'}, {'name': 'Мощность', 'value': '2200 Вт'}],
+    })
+
+async def mock_price(request):
+    await asyncio.sleep(MOCK_DELAY)
+    return web.json_response({'data': {'products': [{'sizes': [{'price': {'product': 199900}}]}]}})
+
+def mock_urls(article):
+    return (f'http://127.0.0.1:{CARD_PORT}/vol{article // 100000}/part{article // 1000}/{article}/info/ru/card.json',
+            f'http://127.0.0.1:{PRICE_PORT}/cards/v2/detail?nm={article}')
+
+async def session_per_lookup(number):
+    article = FIRST_ARTICLE + number
+    async with aiohttp.ClientSession() as session:
+        response, price = await get_card_info(session, *mock_urls(article))
+    assert response['nm_id'] == article and price == 1999
+
+async def shared_session(number):
+    article = FIRST_ARTICLE + number
+    response, price = await get_card_info(await open_session(), *mock_urls(article))
+    assert response['nm_id'] == article and price == 1999
+
+async def main():
+    card_app = web.Application()
+    card_app.router.add_get('/vol{vol}/part{part}/{id}/info/ru/card.json', mock_card)
+    price_app = web.Application()
+    price_app.router.add_get('/cards/v2/detail', mock_price)
+    async with stub_servers((card_app, CARD_PORT), (price_app, PRICE_PORT)):
+        try:
+            for name, lookup in (('сессия на каждый запрос', session_per_lookup), ('общая сессия', shared_session)):
+                elapsed, latencies = await run_concurrently(NUM_LOOKUPS, IN_FLIGHT, lookup)
+                print(f"{name}: {NUM_LOOKUPS / elapsed:.0f} запросов/сек., {latency_summary(latencies)}")
+        finally:
+            await close_session()
+
+if __name__ == '__main__':
+    asyncio.run(main())
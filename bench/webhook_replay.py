@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Нагрузочная проверка вебхука: воспроизведение обновлений /start (без обращений к Telegram).
+# Замеряется время ответа на запрос с обновлением и число обновлений, прошедших через очередь приложения.
+# Запуск: python bench/webhook_replay.py [число обновлений, 5000] [одновременно, 50]
+
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+from common import int_arg, latency_summary, run_concurrently, stub_servers
+import aiohttp
+from telegram import Bot
+
+# Секрет задается до импорта webhook: обработчик сверяет заголовок запроса с WEBHOOK_SECRET модуля
+os.environ['WEBHOOK_SECRET'] = 'replay'
+from webhook import SECRET_HEADER, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, create_web_app
+
+NUM_UPDATES = int_arg(1, 5000)
+IN_FLIGHT = int_arg(2, 50)
+
+def start_update(update_id):
+    user = {'id': 1000 + update_id % 100, 'is_bot': False, 'first_name': 'Покупатель'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user['id'], 'type': 'private'},
+            'from': user,
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+async def main():
+    application = SimpleNamespace(update_queue=asyncio.Queue(), bot=Bot('123456:replay'))
+    web_app = create_web_app(application)
+    web_app['state']['ready'] = True
+    url = f'http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}'
+
+    async def consume():
+        while True:
+            await application.update_queue.get()
+            application.update_queue.task_done()
+
+    consumer = asyncio.create_task(consume())
+    try:
+        async with stub_servers((web_app, WEBHOOK_PORT)):
+            async with aiohttp.ClientSession(headers={SECRET_HEADER: WEBHOOK_SECRET}) as session:
+
+                async def send(number):
+                    async with session.post(url, json=start_update(number + 1)) as response:
+                        await response.read()
+                        assert response.status == 200, response.status
+
+                started = time.perf_counter()
+                _, latencies = await run_concurrently(NUM_UPDATES, IN_FLIGHT, send)
+                await application.update_queue.join()
+                elapsed = time.perf_counter() - started
+    finally:
+        consumer.cancel()
+
+    print(f"Обновлений: {NUM_UPDATES}, одновременно: {IN_FLIGHT}")
+    print(f"Обновлений в секунду: {NUM_UPDATES / elapsed:.0f}")
+    print(f"Время ответа: {latency_summary(latencies)}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,11 +1,16 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, ContextTypes
 import asyncio
+import time
 from dotenv import load_dotenv
 import os
-from revgen import generate_reviews
-from wbparser import get_product_info
-import aiosqlite
+from revgen import generate_reviews, init_client, close_client
+from wbparser import get_product_info, open_session, close_session
+import storage
+from scheduler import GenerationScheduler, QueueFull
+from jobqueue import DatabaseJobQueue
+from persistence import SQLitePersistence
+from webhook import run_webhook
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -14,6 +19,25 @@ load_dotenv()
 TG_API_TOKEN = os.getenv('TG_API_TOKEN')
 DB_PATH = os.getenv('DB_PATH')
 
+# Очередь заданий на генерацию: число одновременных генераций и максимальная длина очереди
+scheduler = GenerationScheduler(
+    num_workers=int(os.getenv('GEN_WORKERS', 4)),
+    max_queue=int(os.getenv('GEN_QUEUE_SIZE', 100)),
+)
+
+# Где выполняются генерации: memory - в процессе бота, db - в отдельных процессах worker.py через таблицу jobs
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'memory')
+job_queue = DatabaseJobQueue(max_queue=int(os.getenv('GEN_QUEUE_SIZE', 100))) if JOB_BACKEND == 'db' else None
+
+# Интервал сохранения данных пользователей и состояний диалогов в базу данных, сек.
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', 5))
+
+# Режим получения обновлений от Telegram: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Сколько секунд при остановке бота ждать завершения принятых генераций
+GEN_DRAIN_TIMEOUT = float(os.getenv('GEN_DRAIN_TIMEOUT', 300))
+
 # Состояния для ConversationHandler
 ARTICLE, MODEL, RATING, PREF, GENDER, NUMBER, FORMAT = range(7)
 
@@ -26,15 +50,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Используйте команду /generate для начала работы."
     )
 
-# Функция для проверки и регистрации пользователя в базе данных
+# Пользователи, уже записанные в базу данных (id -> имя), чтобы не обращаться к бд при каждой команде
+known_users = {}
+
+# Функция для регистрации пользователя в базе данных (или обновления его имени)
 async def ensure_user_registered(user_id, user_name):
     
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT id_user FROM users WHERE id_user = ?", (user_id,))
-        user = await cursor.fetchone()
-        if user is None:
-            await db.execute("INSERT INTO users (id_user, user_name) VALUES (?, ?)", (user_id, user_name))
-            await db.commit()
+    if known_users.get(user_id) == user_name:
+        return
+    await storage.write("""
+        INSERT INTO users (id_user, user_name) VALUES (?, ?)
+        ON CONFLICT(id_user) DO UPDATE SET user_name = excluded.user_name WHERE user_name IS NOT excluded.user_name
+    """, (user_id, user_name))
+    known_users[user_id] = user_name
 
 # Обработчик команды генерации отзывов
 async def generate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -87,19 +115,22 @@ async def receive_article_for_autogenerate(update: Update, context: ContextTypes
                 'rating_preference':'balanced',
                 'gender_preference': None,  
                 'num_reviews': 5,          
-                'format_type': 'xlsx'     
+                'format_type': 'xlsx'
             })
             
-            await update.message.reply_text("Генерация отзывов началась.\nЭто может занять некоторое время...")
-            asyncio.create_task(register_generation(
+            # Проверенная карточка передается только этому заданию: данные пользователя хранятся в бд,
+            # и сохраненная в них карточка со временем устарела бы
+            await enqueue_generation(
+                update.message,
                 context.user_data['user_id'], 
                 article, 
                 'gpt-4o-mini', 
                 'balanced',
                 None, 
                 5, 
-                'xlsx', update
-            ))
+                'xlsx',
+                product_data
+            )
             return ConversationHandler.END
 
 # Обработчик для получения и проверки артикула товара (для generate)
@@ -244,29 +275,83 @@ async def format_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     model_name = context.user_data['model']
     gender_preference = context.user_data['gender_preference']
     
-    await query.message.reply_text("Генерация отзывов началась.\nЭто может занять некоторое время...")
-
-    asyncio.create_task(register_generation(user_id, product_id, model_name, rating_preference, gender_preference, num_reviews, format_type, query))
+    # Карточка товара берется из кэша в самом задании (после проверки артикула она уже в кэше)
+    await enqueue_generation(query.message, user_id, product_id, model_name, rating_preference, gender_preference, num_reviews, format_type)
 
     return ConversationHandler.END
 
-# Функция генерации отзывов (и записи информации о генерации в бд)
-async def register_generation(user_id, product_id, model_name, rating_preference, gender_preference, num_reviews, format_type, query):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
+# Постановка генерации в очередь с уведомлением пользователя о его позиции в очереди
+async def enqueue_generation(message, user_id, *args):
+    # Задание описывается только сериализуемыми данными: результат отправляется в чат по chat_id
+    job_args = (message.chat_id, user_id, *args)
+    try:
+        if job_queue is not None:
+            position = await job_queue.submit(user_id, job_args)
+        else:
+            position = await scheduler.submit(user_id, register_generation, message.get_bot(), *job_args)
+    except QueueFull:
+        await message.reply_text("Сейчас бот перегружен запросами.\n"
+                                 "Пожалуйста, попробуйте позже.")
+        return
+    
+    if position == 0:
+        await message.reply_text("Генерация отзывов началась.\nЭто может занять некоторое время...")
+    else:
+        await message.reply_text(f"Ваша генерация поставлена в очередь (позиция: {position}).\n"
+                                 "Она начнется автоматически, как только освободится место.")
+
+# Минимальный интервал между обновлениями сообщения о прогрессе (Telegram ограничивает частоту редактирования)
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', 1.5))
+
+# Сообщение о прогрессе генерации, которое обновляется по мере готовности отзывов (возвращает сообщение и функцию обновления)
+async def make_progress_reporter(bot, chat_id, num_reviews):
+    progress_message = await bot.send_message(chat_id, f"Готово отзывов: 0 из {num_reviews}")
+    last_update = time.monotonic()
+
+    async def progress(done, total):
+        nonlocal last_update
+        now = time.monotonic()
+        if done < total and now - last_update < PROGRESS_INTERVAL:
+            return
+        last_update = now
+        await progress_message.edit_text(f"Готово отзывов: {done} из {total}")
+
+    return progress_message, progress
+
+# Уведомление пользователя о том, что генерация не удалась (сообщение о прогрессе, если оно есть, завершается)
+async def notify_generation_failed(bot, chat_id, progress_message=None):
+    try:
+        if progress_message is not None:
+            await progress_message.edit_text("Генерация прервана из-за ошибки.")
+        await bot.send_message(chat_id, "Не удалось сгенерировать отзывы.\nПопробуйте повторить генерацию позже.")
+    except Exception as e:
+        print(f"Ошибка при отправке уведомления о неудачной генерации: {e}")
+
+# Функция генерации отзывов (и записи информации о генерации в бд), результат отправляется в чат chat_id
+# При ошибке пользователь получает уведомление, а исключение передается дальше (для учета в метриках очереди)
+# use_cache=False - ответы модели не берутся из кэша (повторная генерация должна дать новые отзывы)
+async def register_generation(bot, chat_id, user_id, product_id, model_name, rating_preference, gender_preference, num_reviews, format_type, product_data=None, use_cache=True):
+    progress_message = None
+    try:
+        result = await storage.write("""
             INSERT INTO generation (id_user, id_product, model, rating_pref, num_reviews) VALUES (?, ?, ?, ?, ?)
         """, (user_id, product_id, model_name, rating_preference, num_reviews))
-        await db.commit()
-        cursor = await db.execute("SELECT last_insert_rowid()")
-        id_gen = (await cursor.fetchone())[0]
+        id_gen = result.lastrowid
         
-    review_output = await generate_reviews(product_id, id_gen, rating_preference, gender_preference, num_reviews, model_name, format_type)
+        progress_message, progress = await make_progress_reporter(bot, chat_id, num_reviews)
+        review_output = await generate_reviews(product_id, id_gen, rating_preference, gender_preference, num_reviews, model_name, format_type, product_data,
+                                             progress=progress, use_cache=use_cache)
 
-    if isinstance(review_output, str):
-        with open(review_output, 'rb') as file:
-            await query.message.reply_document(document=file, filename=os.path.basename(review_output))
-    else:
-        await query.message.reply_document(document=review_output, filename=f'reviews.{format_type}')
+        if review_output is None:
+            await bot.send_message(chat_id, "Не удалось получить данные о товаре.\nПопробуйте повторить генерацию позже.")
+        elif isinstance(review_output, str):
+            with open(review_output, 'rb') as file:
+                await bot.send_document(chat_id, document=file, filename=os.path.basename(review_output))
+        else:
+            await bot.send_document(chat_id, document=review_output, filename=f'reviews.{format_type}')
+    except Exception:
+        await notify_generation_failed(bot, chat_id, progress_message)
+        raise
 
 # Запуск повторной генерации отзывов 
 async def regenerate_reviews(query, context):
@@ -278,11 +363,13 @@ async def regenerate_reviews(query, context):
     model_name = context.user_data['model']
     rating_preference =context.user_data['rating_preference']
     gender_preference = context.user_data['gender_preference']
+    # Карточку, сохраненную в данных пользователя прежними версиями бота, не используем: задание
+    # получит актуальную карточку и цену через кэш карточек товаров
+    context.user_data.pop('product_data', None)
     
-    await query.message.reply_text("Генерация отзывов началась.\n" 
-                                   "Это может занять некоторое время...")
-    
-    asyncio.create_task(register_generation(user_id, product_id, model_name, rating_preference, gender_preference, num_reviews, format_type, query))
+    # Повторная генерация выполняется без кэша ответов модели, иначе при COMPLETION_CACHE она вернула бы похожие отзывы
+    await enqueue_generation(query.message, user_id, product_id, model_name, rating_preference, gender_preference, num_reviews, format_type,
+                             None, False)
 
     return ConversationHandler.END
 
@@ -295,8 +382,34 @@ async def regenerate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.message.reply_text("Не найдены данные для повторной генерации.\n" 
                                         "Пожалуйста, используйте /generate для начала новой генерации.")
 
+# Инициализация общих ресурсов при запуске бота
+async def on_startup(app: Application) -> None:
+    await storage.open_db(DB_PATH)
+    await init_client()
+    await open_session()
+    scheduler.start()
+
+# Завершение принятых генераций при остановке бота (бот еще может отправлять сообщения)
+async def on_stop(app: Application) -> None:
+    await scheduler.drain(GEN_DRAIN_TIMEOUT)
+
+# Освобождение общих ресурсов при остановке бота
+async def on_shutdown(app: Application) -> None:
+    await scheduler.stop()
+    await close_client()
+    await close_session()
+    await storage.close_db()
+
+# Состояние очереди генераций для проверки готовности (/readyz)
+async def scheduler_status():
+    if job_queue is not None:
+        return {'job_backend': JOB_BACKEND, 'queue_depth': await job_queue.depth(), 'active_jobs': await job_queue.active()}
+    return {'queue_depth': scheduler.depth(), 'active_jobs': scheduler.active()}
+
 def main():
-    app = Application.builder().token(TG_API_TOKEN).build()
+    # Данные пользователей и состояния диалогов хранятся в базе данных и переживают перезапуск бота
+    persistence = SQLitePersistence(update_interval=PERSISTENCE_INTERVAL)
+    app = Application.builder().token(TG_API_TOKEN).persistence(persistence).post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown).build()
     
     # Создание обработчика диалогов 
     manual_handler = ConversationHandler(
@@ -316,7 +429,9 @@ def main():
         fallbacks=[CommandHandler('start', start)],
         per_message=False,
         per_chat=True,
-        per_user=True 
+        per_user=True,
+        name='manual_generation',
+        persistent=True
     )
 
     auto_handler = ConversationHandler(
@@ -330,14 +445,20 @@ def main():
         fallbacks=[CommandHandler('start', start)],
         per_message=False,
         per_chat=True,
-        per_user=True 
+        per_user=True,
+        name='auto_generation',
+        persistent=True
     )
 
     app.add_handler(manual_handler)
     app.add_handler(auto_handler)
     app.add_handler(CommandHandler('regenerate', regenerate))
     app.add_handler(CommandHandler('autogenerate', autogenerate))
-    app.run_polling()
+    
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(app, on_startup, on_stop, on_shutdown, scheduler_status))
+    else:
+        app.run_polling()
     
 if __name__ == '__main__':
 
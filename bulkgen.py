@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from dotenv import load_dotenv
+import metrics
+import storage
+from export import export_rows, EXPORT_FORMATS
+from revgen import init_client, close_client, generate_review_rows, if_windows
+from wbparser import get_product_info, open_session, close_session
+
+# Загрузка переменных окружения
+load_dotenv()
+
+DB_PATH = os.getenv('DB_PATH')
+
+# Число одновременно генерируемых товаров и одновременно запрашиваемых карточек товаров
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', 4))
+BULK_PREFETCH_CONCURRENCY = int(os.getenv('BULK_PREFETCH_CONCURRENCY', 20))
+
+# Артикул Wildberries: от 6 до 9 цифр (как при вводе в боте)
+ARTICLE_PATTERN = re.compile(r'^\d{6,9}$')
+
+def read_articles(lines):
+    """Функция для чтения артикулов (через пробелы, запятые или с новой строки) без повторов и с сохранением порядка."""
+
+    articles = []
+    seen = set()
+    for line in lines:
+        for article in re.split(r'[\s,;]+', line.strip()):
+            if not article:
+                continue
+            if not ARTICLE_PATTERN.match(article):
+                print(f"Пропущен некорректный артикул: {article}")
+                continue
+            if article not in seen:
+                seen.add(article)
+                articles.append(article)
+    return articles
+
+async def create_run(articles, params):
+    """Асинхронная функция для создания запуска массовой генерации (возвращает id_run)."""
+
+    result = await storage.write(
+        "INSERT INTO bulk_runs (params, created_at) VALUES (?, ?)", (json.dumps(params, ensure_ascii=False), time.time()))
+    id_run = result.lastrowid
+    await storage.write_many(
+        "INSERT OR IGNORE INTO bulk_run_items (id_run, position, article, status) VALUES (?, ?, ?, 'pending')",
+        [(id_run, position, article) for position, article in enumerate(articles)])
+    return id_run
+
+async def load_run(id_run):
+    """Асинхронная функция возвращает параметры запуска и еще не обработанные артикулы (или None, если запуска нет)."""
+
+    row = await storage.fetchone("SELECT params FROM bulk_runs WHERE id_run = ?", (id_run,))
+    if row is None:
+        return None
+    rows = await storage.fetchall(
+        "SELECT article FROM bulk_run_items WHERE id_run = ? AND status != 'done' ORDER BY position", (id_run,))
+    return json.loads(row[0]), [article for article, in rows]
+
+async def checkpoint(id_run, article, status, id_gen=None, num_reviews=None, error=None):
+    await storage.write("""
+        UPDATE bulk_run_items SET status = ?, id_gen = ?, num_reviews = ?, error = ?, updated_at = ?
+        WHERE id_run = ? AND article = ?
+    """, (status, id_gen, num_reviews, error, time.time(), id_run, article))
+
+async def prefetch(articles, concurrency=BULK_PREFETCH_CONCURRENCY):
+    """Асинхронная функция для одновременного получения карточек всех товаров (артикул -> карточка или None)."""
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(article):
+        async with semaphore:
+            try:
+                return await get_product_info(article)
+            except Exception as e:
+                print(f"Ошибка при получении карточки товара {article}: {e}")
+                return None
+
+    with metrics.timer('bulk_prefetch_seconds'):
+        cards = await asyncio.gather(*(fetch(article) for article in articles))
+    return dict(zip(articles, cards))
+
+# Seed выбора покупателей для товара: общий seed запуска и артикул (у каждого товара свой набор покупателей,
+# который не зависит от порядка обработки и воспроизводится при --resume)
+def article_seed(seed, article):
+    return None if seed is None else [seed, int(article)]
+
+async def generate_article(id_run, article, product_data, params):
+    """Асинхронная функция генерации отзывов на один товар с записью результата в bulk_run_items."""
+
+    if not product_data:
+        await checkpoint(id_run, article, 'not_found')
+        return 0
+    try:
+        result = await storage.write("""
+            INSERT INTO generation (id_user, id_product, model, rating_pref, num_reviews) VALUES (?, ?, ?, ?, ?)
+        """, (None, article, params['model'], params['rating'], params['num']))
+        id_gen = result.lastrowid
+        # Ошибка записи отзывов в бд тоже отмечает артикул как failed, чтобы --resume обработал его заново
+        rows = await generate_review_rows(article, id_gen, params['rating'], params['gender'], params['num'], params['model'],
+                                          product_data, article_seed(params['seed'], article), raise_save_errors=True)
+    except Exception as e:
+        print(f"Ошибка при генерации отзывов на товар {article}: {e}")
+        await checkpoint(id_run, article, 'failed', error=str(e) or type(e).__name__)
+        return 0
+    await checkpoint(id_run, article, 'done', id_gen, len(rows))
+    return len(rows)
+
+async def run(id_run, articles, params, concurrency=BULK_CONCURRENCY):
+    """Асинхронная функция массовой генерации: сначала все карточки, затем генерация не более concurrency товаров одновременно."""
+
+    cards = await prefetch(articles)
+    found = sum(1 for card in cards.values() if card)
+    print(f"Получено карточек товаров: {found} из {len(articles)}")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def worker(article):
+        nonlocal done
+        async with semaphore:
+            num_reviews = await generate_article(id_run, article, cards[article], params)
+        done += 1
+        metrics.inc('bulk_reviews', num_reviews)
+        print(f"[{done}/{len(articles)}] {article}: отзывов {num_reviews}")
+
+    await asyncio.gather(*(worker(article) for article in articles))
+    await storage.write("UPDATE bulk_runs SET finished_at = ? WHERE id_run = ?", (time.time(), id_run))
+
+async def export_run(id_run, paths):
+    """Асинхронная функция для выгрузки всех отзывов запуска в общие файлы (формат определяется расширением)."""
+
+    rows = await storage.fetchall("""
+        SELECT items.id_gen, items.article, reviews.num_review, reviews.review, reviews.rating, reviews.sex
+        FROM bulk_run_items AS items JOIN reviews ON reviews.id_gen = items.id_gen
+        WHERE items.id_run = ? AND items.status = 'done'
+        ORDER BY items.position, reviews.num_review
+    """, (id_run,))
+    records = [
+        {'id_gen': id_gen, 'product_id': article, 'num_review': num_review, 'review': review, 'rating': rating, 'sex': sex}
+        for id_gen, article, num_review, review, rating, sex in rows
+    ]
+    for path in paths:
+        output = export_rows(records, os.path.splitext(path)[1].lstrip('.'))
+        if output is not None:
+            with open(path, 'wb') as file:
+                file.write(output.getvalue())
+            print(f"Отзывы ({len(records)}) сохранены в файл {path}")
+
+def report(elapsed, before):
+    """Функция выводит производительность запуска: отзывы и токены в минуту."""
+
+    counters = metrics.counters
+    reviews = counters['bulk_reviews'] - before.get('bulk_reviews', 0)
+    prompt_tokens = counters['openai_prompt_tokens'] - before.get('openai_prompt_tokens', 0)
+    completion_tokens = counters['openai_completion_tokens'] - before.get('openai_completion_tokens', 0)
+    cached_tokens = counters['openai_cached_tokens'] - before.get('openai_cached_tokens', 0)
+    minutes = elapsed / 60 if elapsed else 1
+    print(f"Время: {elapsed:.1f} сек., отзывов: {reviews}")
+    print(f"Отзывов в минуту: {reviews / minutes:.1f}")
+    print(f"Токенов в минуту: {(prompt_tokens + completion_tokens) / minutes:.0f} "
+          f"(промпт {prompt_tokens}, ответы {completion_tokens}, из кэша OpenAI {cached_tokens})")
+
+async def main(args):
+    try:
+        await storage.open_db(DB_PATH)
+        await init_client()
+        await open_session()
+        if args.resume is not None:
+            loaded = await load_run(args.resume)
+            if loaded is None:
+                print(f"Запуск {args.resume} не найден")
+                return
+            id_run = args.resume
+            params, articles = loaded
+            print(f"Запуск {id_run}: осталось обработать артикулов: {len(articles)}")
+        else:
+            source = sys.stdin if args.articles == '-' else open(args.articles, encoding='utf-8')
+            with source:
+                articles = read_articles(source)
+            params = {'num': args.num, 'model': args.model, 'rating': args.rating, 'gender': args.gender, 'seed': args.seed}
+            id_run = await create_run(articles, params)
+            print(f"Запуск {id_run}: артикулов {len(articles)}")
+
+        before = dict(metrics.counters)
+        started = time.perf_counter()
+        await run(id_run, articles, params, args.concurrency)
+        report(time.perf_counter() - started, before)
+
+        if args.output:
+            await export_run(id_run, args.output)
+    finally:
+        await close_client()
+        await close_session()
+        await storage.close_db()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Массовая генерация отзывов по списку артикулов Wildberries")
+    parser.add_argument('articles', nargs='?', default='-', help="Файл со списком артикулов ('-' - стандартный ввод)")
+    parser.add_argument('--num', type=int, default=5, help="Количество отзывов на товар")
+    parser.add_argument('--model', default='gpt-4o-mini', help="Модель OpenAI")
+    parser.add_argument('--rating', default='balanced', choices=['balanced', 'positive', 'neutral', 'negative'])
+    parser.add_argument('--gender', default=None, choices=['мужчина', 'женщина'])
+    parser.add_argument('--seed', type=int, default=None, help="Seed для воспроизводимого выбора покупателей")
+    parser.add_argument('--concurrency', type=int, default=BULK_CONCURRENCY, help="Число одновременно генерируемых товаров")
+    parser.add_argument('--output', action='append', default=[],
+                        help=f"Общий файл с отзывами ({', '.join(EXPORT_FORMATS)}), можно указать несколько раз")
+    parser.add_argument('--resume', type=int, default=None, metavar='ID_RUN', help="Продолжить прерванный запуск")
+    args = parser.parse_args()
+
+    if_windows()
+    asyncio.run(main(args))
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+import metrics
+
+class ProductCache:
+    """Кэш карточек товаров в памяти процесса.
+
+    Хранит не более maxsize записей (вытесняются давно не использованные),
+    карточка и цена товара устаревают независимо друг от друга (card_ttl и price_ttl).
+    Устаревшая карточка (но не старше stale_ttl) отдается сразу, а обновляется в фоне.
+    Одновременные промахи по одному артикулу объединяются в один запрос к loader.
+    Если задано постоянное хранилище (snapshot_loader и snapshot_saver), при промахе 
+    сначала читается сохраненная карточка (не старше stale_ttl), а устаревшая карточка обновляется в фоне.
+    Если при обновлении товар не найден (loader вернул None), запись и сохраненная карточка удаляются;
+    ошибка loader при обновлении оставляет прежнюю запись до следующей попытки.
+    """
+
+    def __init__(self, loader, price_loader, price_key, maxsize=1024, card_ttl=6 * 3600, price_ttl=600, stale_ttl=24 * 3600,
+                 snapshot_loader=None, snapshot_saver=None, name='product_cache'):
+        self.loader = loader                    # async loader(key) -> dict или None (товар не найден)
+        self.price_loader = price_loader        # async price_loader(key) -> цена или None
+        self.snapshot_loader = snapshot_loader  # async snapshot_loader(key) -> (dict, fetched_at) или None
+        self.snapshot_saver = snapshot_saver    # async snapshot_saver(key, dict или None, fetched_at=None)
+        self.price_key = price_key
+        self.maxsize = maxsize
+        self.card_ttl = card_ttl
+        self.price_ttl = price_ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._entries = OrderedDict()  # key -> [data, card_time, price_time]
+        self._inflight = {}
+        self._background = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _inc(self, event):
+        metrics.inc(f'{self.name}_{event}')
+
+    async def get(self, key):
+        """Асинхронный метод для получения карточки товара из кэша (или загрузки при промахе)."""
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            data, card_time, price_time = entry
+            now = time.time()
+            card_age = now - card_time
+            if card_age < self.stale_ttl:
+                self._entries.move_to_end(key)
+                if card_age < self.card_ttl:
+                    self._inc('hits')
+                    if now - price_time >= self.price_ttl:
+                        self._refresh(key, price_only=True)
+                else:
+                    self._inc('stale_hits')
+                    self._refresh(key)
+                return dict(data)
+
+            # Слишком старую запись не отдаем, а загружаем заново
+            self._inc('expired')
+            del self._entries[key]
+
+        self._inc('misses')
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._spawn(key, self._load(key))
+        else:
+            self._inc('coalesced')
+        try:
+            data = await asyncio.shield(task)
+        except Exception:
+            # Ошибка загрузки уже выведена в _finish
+            return None
+        return dict(data) if data is not None else None
+
+    def put(self, key, data, fetched_at=None, price_fetched_at=None):
+        """Метод для записи карточки товара в кэш с вытеснением давно не использованных записей."""
+
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        price_fetched_at = fetched_at if price_fetched_at is None else price_fetched_at
+        self._entries[key] = [data, fetched_at, price_fetched_at]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._inc('evictions')
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        """Метод возвращает размер кэша и счетчики попаданий, промахов и вытеснений."""
+
+        prefix = f'{self.name}_'
+        stats = {name[len(prefix):]: value for name, value in metrics.counters.items() if name.startswith(prefix)}
+        stats['size'] = len(self._entries)
+        return stats
+
+    async def _load(self, key, use_snapshot=True):
+        # Сохраненную карточку нужно удалить, если товар больше не найден (при обновлении она точно есть)
+        has_snapshot = not use_snapshot
+        if use_snapshot and self.snapshot_loader is not None:
+            snapshot = await self.snapshot_loader(key)
+            if snapshot is not None:
+                has_snapshot = True
+                data, fetched_at = snapshot
+                age = time.time() - fetched_at
+                # Как и в get, слишком старую карточку не отдаем, а загружаем заново
+                if age < self.stale_ttl:
+                    self._inc('snapshot_hits')
+                    self.put(key, data, fetched_at)
+                    if age >= self.card_ttl:
+                        self._refresh(key)
+                    elif age >= self.price_ttl:
+                        self._refresh(key, price_only=True)
+                    return data
+                self._inc('snapshot_expired')
+
+        data = await self.loader(key)
+        if data is not None:
+            self.put(key, data)
+            if self.snapshot_saver is not None:
+                await self.snapshot_saver(key, data)
+        else:
+            # Товар не найден (например, снят с продажи): устаревшая карточка больше не отдается
+            self._inc('not_found')
+            self.invalidate(key)
+            if has_snapshot and self.snapshot_saver is not None:
+                await self.snapshot_saver(key, None)
+        return data
+
+    async def _load_price(self, key):
+        price = await self.price_loader(key)
+        entry = self._entries.get(key)
+        if entry is not None:
+            # Если цену получить не удалось, оставляем прежнюю до следующей попытки
+            entry[2] = time.time()
+            if price is not None and price != entry[0].get(self.price_key):
+                entry[0] = {**entry[0], self.price_key: price}
+                # Новая цена сохраняется вместе с карточкой, время получения карточки не меняется
+                if self.snapshot_saver is not None:
+                    await self.snapshot_saver(key, entry[0], entry[1])
+
+    def _refresh(self, key, price_only=False):
+        inflight_key = (key, 'price' if price_only else 'card')
+        if inflight_key in self._inflight:
+            return
+        self._inc('price_refreshes' if price_only else 'refreshes')
+        coro = self._load_price(key) if price_only else self._load(key, use_snapshot=False)
+        self._spawn(inflight_key, coro)
+
+    def _spawn(self, inflight_key, coro):
+        task = asyncio.ensure_future(coro)
+        self._inflight[inflight_key] = task
+        self._background.add(task)
+        task.add_done_callback(lambda done: self._finish(inflight_key, done))
+        return task
+
+    def _finish(self, inflight_key, task):
+        self._inflight.pop(inflight_key, None)
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Ошибка при обновлении кэша {self.name}: {task.exception()}")
+
+def completion_key(model_name, prompt, **params):
+    """Функция возвращает ключ кэша ответов: хэш модели, промпта (без учета лишних пробелов и переносов) и параметров генерации."""
+
+    normalized = ' '.join(prompt.split())
+    raw = json.dumps([model_name, normalized, params], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class CompletionCache:
+    """Кэш ответов модели в памяти процесса.
+
+    Хранит не более maxsize ответов общим объемом не более max_bytes (вытесняются давно
+    не использованные), каждый ответ действителен ttl секунд. Одновременные промахи
+    по одному ключу объединяются в один запрос к модели. Для каждого ответа запоминается
+    число израсходованных токенов, чтобы считать сэкономленные попаданиями токены.
+    """
+
+    def __init__(self, maxsize=1000, max_bytes=16 * 1024 * 1024, ttl=24 * 3600, name='completion_cache'):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.name = name
+        self._entries = OrderedDict()  # key -> (value, tokens, created_at, size)
+        self._bytes = 0
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _inc(self, event, value=1):
+        metrics.inc(f'{self.name}_{event}', value)
+
+    async def get_or_create(self, key, create):
+        """Асинхронный метод возвращает ответ из кэша, а при промахе - результат create() -> (ответ, число токенов)."""
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, tokens, created_at, _ = entry
+            if time.time() - created_at < self.ttl:
+                self._entries.move_to_end(key)
+                self._inc('hits')
+                self._inc('tokens_saved', tokens)
+                return value
+            self._inc('expired')
+            self._remove(key)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            # Ожидающий чужого запроса получает тот же ответ без расхода токенов (считается попаданием)
+            self._inc('coalesced')
+            value = await asyncio.shield(task)
+            entry = self._entries.get(key)
+            self._inc('hits')
+            self._inc('tokens_saved', entry[1] if entry is not None else 0)
+            return value
+
+        self._inc('misses')
+        task = asyncio.ensure_future(self._create(key, create))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        # Ошибку получают ожидающие запроса; если их уже нет (отмена), она просто отбрасывается
+        if not task.cancelled():
+            task.exception()
+
+    async def _create(self, key, create):
+        value, tokens = await create()
+        self.put(key, value, tokens)
+        return value
+
+    def put(self, key, value, tokens=0):
+        """Метод для записи ответа в кэш с вытеснением давно не использованных записей."""
+
+        size = len(value.encode('utf-8')) if isinstance(value, str) else 0
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, tokens, time.time(), size)
+        self._bytes += size
+        while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._inc('evictions')
+
+    def _remove(self, key):
+        *_, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, key):
+        if key in self._entries:
+            self._remove(key)
+
+    def stats(self):
+        """Метод возвращает размер кэша, долю попаданий и число сэкономленных токенов."""
+
+        prefix = f'{self.name}_'
+        stats = {name[len(prefix):]: value for name, value in metrics.counters.items() if name.startswith(prefix)}
+        requests = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_rate'] = stats.get('hits', 0) / requests if requests else 0.0
+        stats['size'] = len(self._entries)
+        stats['bytes'] = self._bytes
+        return stats
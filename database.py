@@ -1,57 +1,254 @@
+# -*- coding: utf-8 -*-
+
+import os
 import sqlite3
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_PATH = os.getenv('DB_PATH')
+
+# Миграции схемы базы данных: (номер версии, список запросов)
+# Номер последней примененной миграции хранится в PRAGMA user_version
+MIGRATIONS = [
+    (1, [
+        # Таблица users
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id_user INTEGER PRIMARY KEY,
+            user_name TEXT
+        )
+        """,
+        # Таблица products
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id_product INTEGER PRIMARY KEY,
+            product_name TEXT
+        )
+        """,
+        # Таблица generation
+        """
+        CREATE TABLE IF NOT EXISTS generation (
+            id_gen INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_user INTEGER,
+            id_product INTEGER,
+            model TEXT,
+            rating_pref TEXT,
+            num_reviews INTEGER,
+            gen_time TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (id_user) REFERENCES users(id_user),
+            FOREIGN KEY (id_product) REFERENCES products(id_product)
+        )
+        """,
+        # Таблица reviews
+        """
+        CREATE TABLE IF NOT EXISTS reviews (
+            id_gen INTEGER,
+            num_review INTEGER,
+            review TEXT,
+            rating INTEGER,
+            current_situation TEXT,
+            sex TEXT,
+            profession TEXT,
+            marital_status TEXT,
+            children TEXT,
+            hobby TEXT,
+            receipt_time TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            PRIMARY KEY (id_gen, num_review),
+            FOREIGN KEY (id_gen) REFERENCES generation(id_gen)
+        )
+        """,
+    ]),
+    (2, [
+        # Таблица product_snapshots (сохраненные карточки товаров)
+        """
+        CREATE TABLE IF NOT EXISTS product_snapshots (
+            id_product INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            FOREIGN KEY (id_product) REFERENCES products(id_product)
+        )
+        """,
+    ]),
+    (3, [
+        # Индексы для истории генераций пользователя, аналитики по товару и очистки старых записей
+        # (id_gen - это rowid, поэтому он входит в каждый индекс и запросы выполняются только по индексу)
+        "CREATE INDEX IF NOT EXISTS idx_generation_user_time ON generation (id_user, gen_time, id_product)",
+        "CREATE INDEX IF NOT EXISTS idx_generation_product_time ON generation (id_product, gen_time, id_user)",
+        "CREATE INDEX IF NOT EXISTS idx_generation_time ON generation (gen_time)",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_time ON reviews (receipt_time)",
+    ]),
+    (4, [
+        # Таблица scenario_pool (неиспользованные сценарии покупки, общие для генераций по одному товару)
+        """
+        CREATE TABLE IF NOT EXISTS scenario_pool (
+            id_scenario INTEGER PRIMARY KEY,
+            id_product INTEGER NOT NULL,
+            cluster TEXT NOT NULL,
+            scenario TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (id_product) REFERENCES products(id_product)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scenario_pool_product_cluster ON scenario_pool (id_product, cluster)",
+    ]),
+    (5, [
+        # Таблица persistence (данные пользователей и состояния диалогов бота в JSON)
+        """
+        CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+        """,
+        # Таблица jobs (общая очередь заданий на генерацию для процессов-обработчиков)
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id_job INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_user INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            worker TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            FOREIGN KEY (id_user) REFERENCES users(id_user)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_user ON jobs (status, id_user)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_worker ON jobs (worker)",
+    ]),
+    (6, [
+        # Таблица batch_jobs (пакетные генерации через OpenAI Batch API: этап, id задания OpenAI и промежуточные данные)
+        """
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            id_batch INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_gen INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            openai_batch_id TEXT,
+            state TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (id_gen) REFERENCES generation(id_gen)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_batch_jobs_stage ON batch_jobs (stage)",
+    ]),
+    (7, [
+        # Таблица bulk_runs (запуски массовой генерации по списку артикулов и их параметры)
+        """
+        CREATE TABLE IF NOT EXISTS bulk_runs (
+            id_run INTEGER PRIMARY KEY AUTOINCREMENT,
+            params TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+        """,
+        # Таблица bulk_run_items (состояние обработки каждого артикула запуска)
+        """
+        CREATE TABLE IF NOT EXISTS bulk_run_items (
+            id_run INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            article TEXT NOT NULL,
+            status TEXT NOT NULL,
+            id_gen INTEGER,
+            num_reviews INTEGER,
+            error TEXT,
+            updated_at REAL,
+            PRIMARY KEY (id_run, article),
+            FOREIGN KEY (id_run) REFERENCES bulk_runs(id_run),
+            FOREIGN KEY (id_gen) REFERENCES generation(id_gen)
+        )
+        """,
+    ]),
+    (8, [
+        # Время последнего сигнала обработчика о том, что задание еще выполняется
+        "ALTER TABLE jobs ADD COLUMN heartbeat_at REAL",
+    ]),
+]
+
+# Основные запросы приложения (для проверки планов их выполнения)
+MAIN_QUERIES = {
+    'Проверка пользователя': (
+        "SELECT id_user FROM users WHERE id_user = ?", (1,)),
+    'Проверка товара': (
+        "SELECT id_product FROM products WHERE id_product = ?", (1,)),
+    'Сохраненная карточка товара': (
+        "SELECT data, fetched_at FROM product_snapshots WHERE id_product = ?", (1,)),
+    'История генераций пользователя': (
+        "SELECT id_gen, id_product, gen_time FROM generation WHERE id_user = ? ORDER BY gen_time DESC LIMIT 20", (1,)),
+    'Генерации по товару за период': (
+        "SELECT id_gen, id_user, gen_time FROM generation WHERE id_product = ? AND gen_time >= ?", (1, '2024-01-01')),
+    'Устаревшие генерации': (
+        "SELECT id_gen FROM generation WHERE gen_time < ?", ('2024-01-01',)),
+    'Отзывы генерации': (
+        "SELECT num_review, review, rating FROM reviews WHERE id_gen = ?", (1,)),
+    'Устаревшие отзывы': (
+        "SELECT id_gen, num_review FROM reviews WHERE receipt_time < ?", ('2024-01-01',)),
+    'Сценарии из пула': (
+        "SELECT id_scenario, scenario FROM scenario_pool WHERE id_product = ? AND cluster = ? "
+        "AND created_at >= datetime('now', 'localtime', ?) LIMIT 20", (1, '', '-86400 seconds')),
+    'Данные пользователя': (
+        "SELECT data, updated_at FROM persistence WHERE kind = ? AND key = ? AND updated_at > ?", ('user', '1', 0)),
+    'Следующее задание': (
+        "SELECT id_job FROM jobs WHERE status = 'pending' AND id_user NOT IN "
+        "(SELECT id_user FROM jobs WHERE status = 'running') ORDER BY id_job LIMIT 1", ()),
+}
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(path=DB_PATH):
+    """Функция для применения к базе данных всех еще не примененных миграций (возвращает итоговую версию схемы)."""
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        version = get_version(conn)
+        for target, statements in MIGRATIONS:
+            if target <= version:
+                continue
+            # Каждая миграция применяется целиком в одной транзакции
+            conn.execute("BEGIN")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {target}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            version = target
+        conn.execute("PRAGMA optimize")
+        return version
+    finally:
+        conn.close()
+
+def get_query_plans(path=DB_PATH):
+    """Функция возвращает планы выполнения основных запросов приложения (EXPLAIN QUERY PLAN)."""
+
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            name: [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            for name, (sql, params) in MAIN_QUERIES.items()
+        }
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+
+    if not DB_PATH:
+        raise SystemExit("Не задана переменная окружения DB_PATH")
+
+    version = migrate(DB_PATH)
+    print(f"Схема базы данных обновлена до версии {version}")
 
-conn = sqlite3.connect(r'C:\Users\whati\OneDrive\Рабочий стол\Jup\Diplomus\Review_gen_v8.1\reviews.db')
-cursor = conn.cursor()
-
-# Создаем таблицу users, если она еще не создана
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id_user INTEGER PRIMARY KEY,
-    user_name TEXT
-)
-""")
-
-# Создаем таблицу products, если она еще не создана
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS products (
-    id_product INTEGER PRIMARY KEY,
-    product_name TEXT
-)
-""")
-
-# Создаем таблицу generation, если она еще не создана
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS generation (
-    id_gen INTEGER PRIMARY KEY AUTOINCREMENT,
-    id_user INTEGER,
-    id_product INTEGER,
-    model TEXT,
-    rating_pref TEXT,
-    num_reviews INTEGER,
-    gen_time TIMESTAMP DEFAULT (datetime('now', 'localtime')), 
-    FOREIGN KEY (id_user) REFERENCES users(id_user),
-    FOREIGN KEY (id_product) REFERENCES products(id_product)
-)
-""")
-
-# Создаем таблицу reviews, если она еще не создана
-cursor.execute("""
-CREATE TABLE reviews (
-    id_gen INTEGER,
-    num_review INTEGER,
-    review TEXT,
-    rating INTEGER,
-    current_situation TEXT,
-    sex TEXT,
-    profession TEXT,
-    marital_status TEXT,
-    children TEXT,
-    hobby TEXT,
-    receipt_time TIMESTAMP DEFAULT (datetime('now', 'localtime')),
-    PRIMARY KEY (id_gen, num_review),
-    FOREIGN KEY (id_gen) REFERENCES generation(id_gen)
-)
-""")
-
-conn.commit()
-conn.close()
\ No newline at end of file
+    for name, plan in get_query_plans(DB_PATH).items():
+        print(f"{name}:")
+        for step in plan:
+            print(f"    {step}")
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+from xml.sax.saxutils import escape
+
+# Форматы файлов с отзывами, которые может выбрать пользователь
+EXPORT_FORMATS = ('csv', 'json', 'xml', 'xlsx')
+
+def write_csv(rows, output):
+    """Функция для записи строк (словарей) в CSV."""
+
+    text = io.TextIOWrapper(output, encoding='utf-8', newline='', write_through=True)
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(text, fieldnames=list(row), lineterminator='\n')
+            writer.writeheader()
+        writer.writerow(row)
+    # Буфер не должен закрываться вместе с оберткой
+    text.detach()
+
+def write_json(rows, output):
+    """Функция для записи строк (словарей) в JSON (массив объектов)."""
+
+    output.write(b'[')
+    for index, row in enumerate(rows):
+        if index:
+            output.write(b',')
+        output.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    output.write(b']')
+
+def write_xml(rows, output):
+    """Функция для записи строк (словарей) в XML: каждая строка - элемент Review внутри корневого Reviews."""
+
+    output.write(b'<Reviews>')
+    for row in rows:
+        parts = ['<Review>']
+        for key, value in row.items():
+            parts.append(f'<{key}>{escape(str(value))}</{key}>')
+        parts.append('</Review>')
+        output.write(''.join(parts).encode('utf-8'))
+    output.write(b'</Reviews>')
+
+def write_xlsx(rows, output):
+    """Функция для записи строк (словарей) в XLSX (openpyxl импортируется только при выборе этого формата)."""
+
+    from openpyxl import Workbook
+
+    # В режиме write_only строки сразу записываются в файл, не создавая объектов для каждой ячейки
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    header = None
+    for row in rows:
+        if header is None:
+            header = list(row)
+            sheet.append(header)
+        sheet.append([row[key] for key in header])
+    workbook.save(output)
+
+WRITERS = {
+    'csv': write_csv,
+    'json': write_json,
+    'xml': write_xml,
+    'xlsx': write_xlsx,
+}
+
+def export_rows(rows, format_type):
+    """Функция возвращает BytesIO с отзывами в формате format_type (или None для неизвестного формата)."""
+
+    writer = WRITERS.get(format_type)
+    if writer is None:
+        print(f"Неизвестный формат файла: {format_type}")
+        return None
+    output = io.BytesIO()
+    writer(rows, output)
+    output.seek(0)
+    return output
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import uuid
+import metrics
+import storage
+from scheduler import QueueFull
+
+class DatabaseJobQueue:
+    """Очередь заданий на генерацию в базе данных, общая для бота и отдельных процессов-обработчиков (worker.py).
+
+    Бот только записывает задание в таблицу jobs, а обработчики забирают задания по одному.
+    Как и в GenerationScheduler, у каждого пользователя одновременно выполняется не более
+    одного задания. Обработчик периодически обновляет heartbeat_at выполняемого задания (heartbeat),
+    и задание, от обработчика которого timeout секунд не было сигнала, возвращается в очередь.
+    """
+
+    def __init__(self, max_queue=100, timeout=1800, max_attempts=3):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+    async def submit(self, user_id, args):
+        """Асинхронный метод для постановки задания (args - аргументы генерации, сериализуемые в JSON).
+
+        Возвращает 0, если перед заданием нет ожидающих заданий, иначе примерную позицию в очереди.
+        При переполнении очереди возбуждает QueueFull.
+        """
+
+        # Проверка длины очереди и вставка выполняются одним запросом, поэтому несколько экземпляров бота
+        # не могут одновременно пройти проверку и переполнить очередь
+        result = await storage.write("""
+            INSERT INTO jobs (id_user, payload, status, created_at)
+            SELECT ?, ?, 'pending', ? WHERE (SELECT COUNT(*) FROM jobs WHERE status = 'pending') < ?
+        """, (user_id, json.dumps(list(args), ensure_ascii=False), time.time(), self.max_queue))
+        if not result.rowcount:
+            metrics.inc('queue_rejected')
+            raise QueueFull()
+        metrics.inc('queue_submitted')
+
+        ahead, = await storage.fetchone(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND id_job < ?", (result.lastrowid,))
+        busy, = await storage.fetchone(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'running' AND id_user = ?", (user_id,))
+        return ahead + 1 if ahead or busy else 0
+
+    async def claim(self, worker_id):
+        """Асинхронный метод для получения следующего задания обработчиком (возвращает (id_job, user_id, args) или None)."""
+
+        # Задание забирается одним запросом UPDATE, поэтому два процесса не получат одно и то же задание
+        token = f"{worker_id}:{uuid.uuid4().hex}"
+        result = await storage.write("""
+            UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = started_at, attempts = attempts + 1
+            WHERE id_job = (
+                SELECT id_job FROM jobs
+                WHERE status = 'pending' AND id_user NOT IN (SELECT id_user FROM jobs WHERE status = 'running')
+                ORDER BY id_job LIMIT 1
+            )
+        """, (token, time.time()))
+        if not result.rowcount:
+            return None
+
+        id_job, user_id, payload, created_at = await storage.fetchone(
+            "SELECT id_job, id_user, payload, created_at FROM jobs WHERE worker = ?", (token,))
+        metrics.observe('queue_wait_seconds', time.time() - created_at)
+        return id_job, user_id, json.loads(payload)
+
+    async def complete(self, id_job, error=None):
+        """Асинхронный метод для отметки о завершении задания (error - текст ошибки, если генерация не удалась)."""
+
+        metrics.inc('jobs_failed' if error else 'jobs_completed')
+        await storage.write(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id_job = ?",
+            ('failed' if error else 'done', time.time(), error, id_job))
+
+    async def heartbeat(self, id_job):
+        """Асинхронный метод, отмечающий, что обработчик еще выполняет задание."""
+
+        await storage.write("UPDATE jobs SET heartbeat_at = ? WHERE id_job = ? AND status = 'running'", (time.time(), id_job))
+
+    async def requeue_stale(self):
+        """Асинхронный метод, возвращающий в очередь задания, от обработчиков которых timeout секунд не было сигнала
+        (например, после сбоя обработчика). Медленные, но живые генерации не возвращаются, поэтому не выполняются дважды.
+
+        Задания, исчерпавшие max_attempts попыток, отмечаются как неудачные и возвращаются списком
+        (id_job, user_id, args), чтобы обработчик мог уведомить пользователей.
+        """
+
+        deadline = time.time() - self.timeout
+        token = f"timeout:{uuid.uuid4().hex}"
+        result = await storage.write("""
+            UPDATE jobs SET status = 'failed', finished_at = ?, error = 'timeout', worker = ?
+            WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ? AND attempts >= ?
+        """, (time.time(), token, deadline, self.max_attempts))
+        failed = []
+        if result.rowcount:
+            metrics.inc('jobs_failed', result.rowcount)
+            rows = await storage.fetchall("SELECT id_job, id_user, payload FROM jobs WHERE worker = ?", (token,))
+            failed = [(id_job, user_id, json.loads(payload)) for id_job, user_id, payload in rows]
+        result = await storage.write(
+            "UPDATE jobs SET status = 'pending', worker = NULL WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ?", (deadline,))
+        if result.rowcount:
+            metrics.inc('jobs_requeued', result.rowcount)
+            print(f"Возвращено в очередь зависших заданий: {result.rowcount}")
+        return failed
+
+    async def depth(self):
+        count, = await storage.fetchone("SELECT COUNT(*) FROM jobs WHERE status = 'pending'")
+        return count
+
+    async def active(self):
+        count, = await storage.fetchone("SELECT COUNT(*) FROM jobs WHERE status = 'running'")
+        return count
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import time
+from collections import Counter, defaultdict, deque
+
+# Счетчики событий (число запросов, попаданий в кэш и т.д.)
+counters = Counter()
+
+# Последние замеры длительностей и других величин
+samples = defaultdict(lambda: deque(maxlen=1000))
+
+def inc(name, value=1):
+    """Функция для увеличения счетчика."""
+    counters[name] += value
+
+def observe(name, value):
+    """Функция для записи замера (например, времени выполнения в секундах)."""
+    samples[name].append(value)
+
+def percentile(name, q):
+    """Функция для получения перцентиля q (от 0 до 100) по записанным замерам."""
+    values = sorted(samples.get(name, ()))
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+def snapshot():
+    """Функция возвращает текущие значения счетчиков и перцентили замеров."""
+    return {
+        'counters': dict(counters),
+        'samples': {
+            name: {'count': len(values), 'p50': percentile(name, 50), 'p99': percentile(name, 99)}
+            for name, values in samples.items()
+        },
+    }
+
+class timer:
+    """Контекстный менеджер для замера времени выполнения блока кода."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+from telegram.ext import BasePersistence, PersistenceInput
+import storage
+
+# Раздел таблицы persistence для состояний диалога с заданным именем
+def conversation_kind(name):
+    return f"conversation:{name}"
+
+class SQLitePersistence(BasePersistence):
+    """Хранение данных пользователей и состояний диалогов (ConversationHandler) в базе данных бота.
+
+    Данные сохраняются в таблицу persistence в виде JSON, поэтому переживают перезапуск
+    и доступны всем экземплярам бота, работающим с одной базой. Перед обработкой каждого
+    обновления данные пользователя перечитываются, если другой экземпляр сохранил их позже.
+    """
+
+    def __init__(self, store_data=None, update_interval=5):
+        if store_data is None:
+            store_data = PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False)
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        # Время последнего сохранения или чтения каждой записи (kind, key) этим экземпляром
+        self._versions = {}
+
+    async def _load_kind(self, kind):
+        rows = await storage.fetchall("SELECT key, data, updated_at FROM persistence WHERE kind = ?", (kind,))
+        result = {}
+        for key, data, updated_at in rows:
+            self._versions[(kind, key)] = updated_at
+            result[key] = json.loads(data)
+        return result
+
+    async def _save(self, kind, key, data):
+        updated_at = time.time()
+        self._versions[(kind, key)] = updated_at
+        await storage.write("""
+            INSERT INTO persistence (kind, key, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        """, (kind, key, json.dumps(data, ensure_ascii=False), updated_at))
+
+    async def _drop(self, kind, key):
+        self._versions.pop((kind, key), None)
+        await storage.write("DELETE FROM persistence WHERE kind = ? AND key = ?", (kind, key))
+
+    async def _refresh(self, kind, key, target):
+        # Данные заменяются только если в базе более новая версия, чем известная этому экземпляру
+        row = await storage.fetchone(
+            "SELECT data, updated_at FROM persistence WHERE kind = ? AND key = ? AND updated_at > ?",
+            (kind, key, self._versions.get((kind, key), 0)))
+        if row is None:
+            return
+        data, updated_at = row
+        self._versions[(kind, key)] = updated_at
+        target.clear()
+        target.update(json.loads(data))
+
+    async def get_user_data(self):
+        return {int(key): data for key, data in (await self._load_kind('user')).items()}
+
+    async def get_chat_data(self):
+        return {int(key): data for key, data in (await self._load_kind('chat')).items()}
+
+    async def get_bot_data(self):
+        return (await self._load_kind('bot')).get('', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {tuple(json.loads(key)): state for key, state in (await self._load_kind(conversation_kind(name))).items()}
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            await self._drop(conversation_kind(name), json.dumps(list(key)))
+        else:
+            await self._save(conversation_kind(name), json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        await self._save('user', str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._save('chat', str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        await self._save('bot', '', data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._drop('user', str(user_id))
+
+    async def drop_chat_data(self, chat_id):
+        await self._drop('chat', str(chat_id))
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh('user', str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh('chat', str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        await self._refresh('bot', '', bot_data)
+
+    async def flush(self):
+        # Каждое изменение уже записано через общий писатель storage, который дожидается commit
+        pass
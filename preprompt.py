@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 import random
+import numpy as np
+from itertools import accumulate
+from types import MappingProxyType
 
 def who_am_i(gender_preference=None):
     """Функция для создания личности покупателя"""
@@ -23,23 +26,22 @@ def who_am_i(gender_preference=None):
 
     return sex, profession, income, marital_status, children, hobby
 
-def get_gender():
-    return random.choice(['мужчина', 'женщина'])
+# Варианты характеристик покупателя и их веса
+GENDERS = ['мужчина', 'женщина']
 
-def get_marital_status_male():
-    return random.choices(["женат", "холост"], weights=[65,30], k=1)[0]
+MARITAL_STATUSES_MALE = ["женат", "холост"]
+MARITAL_STATUSES_MALE_WEIGHTS = [65, 30]
 
-def get_marital_status_female():
-    return random.choices(["замужем", "не замужем"],weights=[80,20], k=1)[0] 
+MARITAL_STATUSES_FEMALE = ["замужем", "не замужем"]
+MARITAL_STATUSES_FEMALE_WEIGHTS = [80, 20]
 
-def get_number_of_children():
-    return random.choices(['1 ребенок', '2 ребенка', '3 ребенка', 'нет детей'], weights=[30,20,10,40], k=1)[0]  
+CHILDREN = ['1 ребенок', '2 ребенка', '3 ребенка', 'нет детей']
+CHILDREN_WEIGHTS = [30, 20, 10, 40]
 
-def get_personal_income():
-    return random.choices(["30000 Рублей", "50000 Рублей", "70000 Рублей", "100000 Рублей", "150000 Рублей", "200000 Рублей", "300000 Рублей", "500000 Рублей", "более 500000 Рублей"], weights=[5, 15, 20, 30, 15, 10, 3, 2, 1], k=1)[0]
+INCOMES = ["30000 Рублей", "50000 Рублей", "70000 Рублей", "100000 Рублей", "150000 Рублей", "200000 Рублей", "300000 Рублей", "500000 Рублей", "более 500000 Рублей"]
+INCOME_WEIGHTS = [5, 15, 20, 30, 15, 10, 3, 2, 1]
 
-def get_male_profession():
-    return random.choice([
+MALE_PROFESSIONS = [
         "Программист", "Строитель", "Инженер", "Водитель", "Врач", 
         "Учитель", "Системный администратор", "Менеджер по продажам", "Электрик", "Шахтёр", 
         "Слесарь", "Полицейский", "Пожарный", "Военнослужащий", "Бухгалтер", 
@@ -50,10 +52,9 @@ def get_male_profession():
         "Охранник", "Менеджер по логистике", "Физик", "Химик", "Рабочий на производстве", 
         "Курьер", "Сантехник", "Специалист по SEO", "Разработчик мобильных приложений", "Консультант по недвижимости", 
         "Монтажник", "Аналитик данных", "Преподаватель вуза", "Музыкант", "Художник"
-    ])
+    ]
 
-def get_female_profession():
-    return random.choice([
+FEMALE_PROFESSIONS = [
         "Врач", "Учитель", "Бухгалтер", "Менеджер по продажам", "Маркетолог", 
         "Юрист", "Экономист", "Психолог", "Дизайнер", "Личный помощник руководителя", 
         "Секретарь", "Фармацевт", "Логист", "Администратор", "Специалист по кадрам (HR)", 
@@ -65,10 +66,9 @@ def get_female_profession():
         "Стоматолог", "Массажист", "Менеджер по работе с клиентами", "Няня", "Аудитор", 
         "Уборщица", "IT-специалист", "Домработница", "Логопед", "Кондуктор", 
         "Хостесс"
-    ])
+    ]
 
-def get_male_hobby():
-    return random.choice([
+MALE_HOBBIES = [
         'Фитнес и бодибилдинг', 'Рыбалка', 'Походы и кемпинг', 'Компьютерные игры', 'Коллекционирование',
         'Чтение', 'Пивоварение', 'Моделирование', 'Фотография', 'Велоспорт',
         'Плавание', 'Автомобили и мотоциклы', 'Музыка', 'Кулинария', 'Путешествия',
@@ -79,10 +79,9 @@ def get_male_hobby():
         'Виниловые коллекции', 'Скейтбординг', 'Баскетбол', 'Ролевые игры', 'Парусный спорт',
         'Кайтсерфинг', 'Лазертаг', 'Воздухоплавание', 'Изучение истории', 'Пивоварение',
         'Подводная охота', 'Авиамоделирование', 'Квадроциклинг', 'Пейнтбол', 'Кроссфит'
-    ])
+    ]
 
-def get_female_hobby():
-    return random.choice([
+FEMALE_HOBBIES = [
         "Йога", "Пилатес", "Бег", "Велоспорт", "Плавание",
         "Танцы", "Рисование", "Живопись", "Фотография", "Пение",
         "Игра на музыкальных инструментах", "Чтение", "Писательство", "Вязание", "Шитьё",
@@ -93,7 +92,82 @@ def get_female_hobby():
         "Мода", "Стиль", "Декорирование интерьера", "Флористика", "Волонтёрство",
         "Блоггинг", "Влоггинг", "Изучение культур", "Астрономия", "Ролевые игры",
         "Видеоигры", "Коллекционирование", "Работа с животными", "Психология", "Фитнес"
-    ])
+    ]
+
+def get_gender():
+    return random.choice(GENDERS)
+
+def get_marital_status_male():
+    return random.choices(MARITAL_STATUSES_MALE, weights=MARITAL_STATUSES_MALE_WEIGHTS, k=1)[0]
+
+def get_marital_status_female():
+    return random.choices(MARITAL_STATUSES_FEMALE, weights=MARITAL_STATUSES_FEMALE_WEIGHTS, k=1)[0] 
+
+def get_number_of_children():
+    return random.choices(CHILDREN, weights=CHILDREN_WEIGHTS, k=1)[0]  
+
+def get_personal_income():
+    return random.choices(INCOMES, weights=INCOME_WEIGHTS, k=1)[0]
+
+def get_male_profession():
+    return random.choice(MALE_PROFESSIONS)
+
+def get_female_profession():
+    return random.choice(FEMALE_PROFESSIONS)
+
+def get_male_hobby():
+    return random.choice(MALE_HOBBIES)
+
+def get_female_hobby():
+    return random.choice(FEMALE_HOBBIES)
+
+# Таблица для выборки из списка значений: массив значений и нормированные накопленные веса
+def _make_table(values, weights=None):
+    if weights is None:
+        weights = np.ones(len(values))
+    cum_weights = np.cumsum(weights, dtype=float)
+    return np.array(values, dtype=object), cum_weights / cum_weights[-1]
+
+# Таблицы строятся один раз при импорте модуля
+_MARITAL_MALE_TABLE = _make_table(MARITAL_STATUSES_MALE, MARITAL_STATUSES_MALE_WEIGHTS)
+_MARITAL_FEMALE_TABLE = _make_table(MARITAL_STATUSES_FEMALE, MARITAL_STATUSES_FEMALE_WEIGHTS)
+_CHILDREN_TABLE = _make_table(CHILDREN, CHILDREN_WEIGHTS)
+_INCOME_TABLE = _make_table(INCOMES, INCOME_WEIGHTS)
+_MALE_PROFESSION_TABLE = _make_table(MALE_PROFESSIONS)
+_FEMALE_PROFESSION_TABLE = _make_table(FEMALE_PROFESSIONS)
+_MALE_HOBBY_TABLE = _make_table(MALE_HOBBIES)
+_FEMALE_HOBBY_TABLE = _make_table(FEMALE_HOBBIES)
+
+def _sample(rng, table, n):
+    values, cum_weights = table
+    return values[np.searchsorted(cum_weights, rng.random(n), side='right')]
+
+def sample_personas(n, gender_preference=None, seed=None):
+    """Функция для создания сразу n личностей покупателей (в том же формате, что и who_am_i).
+    
+    seed - число, последовательность чисел или np.random.Generator; при одинаковом seed результат воспроизводится.
+    """
+    
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    
+    if gender_preference is not None:
+        sexes = np.full(n, gender_preference, dtype=object)
+    else:
+        sexes = np.array(GENDERS, dtype=object)[rng.integers(0, len(GENDERS), n)]
+    is_male = sexes == "мужчина"
+    
+    professions = np.where(is_male, _sample(rng, _MALE_PROFESSION_TABLE, n), _sample(rng, _FEMALE_PROFESSION_TABLE, n))
+    marital_statuses = np.where(is_male, _sample(rng, _MARITAL_MALE_TABLE, n), _sample(rng, _MARITAL_FEMALE_TABLE, n))
+    hobbies = np.where(is_male, _sample(rng, _MALE_HOBBY_TABLE, n), _sample(rng, _FEMALE_HOBBY_TABLE, n))
+    children = _sample(rng, _CHILDREN_TABLE, n)
+    incomes = _sample(rng, _INCOME_TABLE, n)
+    
+    return list(zip(sexes.tolist(), professions.tolist(), incomes.tolist(), marital_statuses.tolist(), children.tolist(), hobbies.tolist()))
+
+# Кластер покупателей для пула сценариев: сценарии покупки в основном зависят от пола, семейного положения и детей.
+# Промпт сценариев для пула (cluster_situation_prompt) содержит только эти поля, поэтому сценарии подходят любому покупателю кластера
+def persona_cluster(sex, profession, income, marital_status, children, hobby):
+    return f"{sex}|{marital_status}|{children}"
 
 # Краткое описание задачи
 def get_task_deskr(product_name):
@@ -159,12 +233,10 @@ def get_situation(context, product_name):
     "И то, даже в этом случае не делай из этого целую \"историю\". "
     )
 
-# Дополнительные инструкции
-def get_additionally():
-    
-    # Стандартная инструкция
-    base_instruction = ("Никогда не начинай отзыв так 'Отзыв:', 'Мой отзыв:', 'Отзыв-', 'В своём отзыве', пиши сразу сам отзыв, а не регламентируй что ты его пишешь, это и так понятно из контекста. "
-    "Не указывай полное название товара в отзыве: ",
+# Стандартная часть дополнительных инструкций
+ADDITIONALLY_BASE = (
+    "Никогда не начинай отзыв так 'Отзыв:', 'Мой отзыв:', 'Отзыв-', 'В своём отзыве', пиши сразу сам отзыв, а не регламентируй что ты его пишешь, это и так понятно из контекста. "
+    "Не указывай полное название товара в отзыве: "
     "Например, полное название товара: 'Телевизор 50/UHD/Smart/WiFi' -  ты пишешь просто телевизор, "
     "полное название товара: 'Куртка бомбер гонщика гоночный стиль оверсайз y2k RedBull', ты пишешь куртка, "
     "полное название товара: 'Креатин моногидрат порошок 200гр спортивный', ты пишешь креатин, "
@@ -172,86 +244,106 @@ def get_additionally():
     "полное название товара: 'Ботинки челси демисезонные, 256Gb, Natural', ты пишешь ботинки. "
     "Также не делай разрывов между предложениями, пиши их слитно"
     "Ещё ни в коем случае не упоминай в отзыве сам Wildberries"
-    )
+)
+
+# Инструкция с использованием смайликов
+EMOJI_INSTRUCTION = "Используй смайлики в отзыв для выражения своих эмоций или описания товара. Добавь до 5-6 смайликов Например, 😊 за восторг, 😡 за разочарование. Можешь использовать любые другие смайлики"
+
+# Вероятность добавления инструкции со смайликами
+EMOJI_PROBABILITY = 0.25
+
+# Выбор, нужно ли использовать смайлики в отзыве
+def use_emoji():
+    return random.random() < EMOJI_PROBABILITY
+
+# Дополнительные инструкции
+def get_additionally(with_emoji=None):
     
-    # Инструкция с использованием смайликов
-    emoji_instruction = "Используй смайлики в отзыв для выражения своих эмоций или описания товара. Добавь до 5-6 смайликов Например, 😊 за восторг, 😡 за разочарование. Можешь использовать любые другие смайлики"
+    if with_emoji is None:
+        with_emoji = use_emoji()
     
-    # С 25% вероятностью добавляем смайлики
-    if random.random() < 0.25:
-        return f"{base_instruction} {emoji_instruction}"
+    if with_emoji:
+        return f"{ADDITIONALLY_BASE} {EMOJI_INSTRUCTION}"
     else:
-        return base_instruction
+        return ADDITIONALLY_BASE
 
-# Типы отзывов
-def get_review_type(product_name, rating_preference):
-    type_variations = {
-            # Эмоциональные
-            "Excited_Emotion": (f"Напиши эмоциональный, восторженный отзыв. Поделись своими эмоциями и ощущениями от покупки {product_name}. Сделай большой упор на чувства, которые у тебя вызвала покупка. Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва)",5),
-            "Positive_Emotion": (f"Напиши умеренно эмоциональный, положительный отзыв. Поделись эмоциями от покупки {product_name}. Сделай больший упор на чувства, которые у тебя вызвала покупка. Ты хочешь поставить этому товару рейтинг 4 из 5 (саму оценку не нужно указывать в тексте отзыва)",4),
-            "Neutral_Emotion": (f'Напиши сбалансированный отзыв о {product_name}. Поделись своим мнением, выражая как положительные, так и отрицательные стороны покупки. Расскажи, какие аспекты тебя порадовали, а что не оправдало ожидания. Избегай чрезмерных эмоций и жалоб. Ты хочешь поставить этому товару рейтинг 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва)',3),
-            "Mildly_Negative_Emotion": (f"Напиши эмоциональный, умеренно негативный отзыв. Такой отзыв, при котором была бы уместна оценка 2 из 5 баллов (саму оценку не нужно указывать в тексте отзыва). Опиши, что именно тебя разочаровало в {product_name}, и какие проблемы ты обнаружил. Пожалуйся, но не слишком переусердствуй. ", 2),
-            "Strong_Negative_Emotion": (f"Напиши эмоциональный, негативный отзыв. Такой отзыв, при котором была бы уместна оценка 1 из 5 баллов (саму оценку не нужно указывать в тексте отзыва). Подчеркни серьёзные недостатки {product_name}, которые вызвали у тебя разочарование и недовольство, и объясни, почему этот товар совершенно не соответствует твоим ожиданиям. Чётко вырази свою неудовлетворённость и предостереги других от покупки. ", 1),
-
-            # Сравнения
-            "Positive_Analytics": (f"Напиши аналитический отзыв: как ты сравнивал {product_name} с другими товарами аналогами. Скажи конкретно, в чём было это сравнение, на что именно ты обращал внимание в первую очередь. И итогом должно стать то, что в результате тщательного отбора и долгого сравнения выбор пал на {product_name}, и ты не жалеешь о своем выборе, наоборот, рад что купил именно {product_name}. Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 5),
-            "Equal_Analytics": (f"Напиши аналитический отзыв: как ты сравнивал {product_name} с другими товарами аналогами. Скажи конкретно, в чём было это сравнение, на что именно ты обращал внимание в первую очередь. По итогу ты считаешь, что купил хороший товар - {product_name}, но и у других, схожих товаров были свои преимущества (скажи какие именно). То есть, ты в целом доволен покупкой, но предлагаешь другим покупателям рассмотреть и другие варианты к покупке. Ты хочешь поставить этому товару рейтинг 4 из 5 (саму оценку не нужно указывать в тексте отзыва)", 4),
-            
-            # Первое впечатление
-            "First_Impression_Positive":( f"Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть положительным . Но из текста должно быть понятно, что ты совсем недавно купил {product_name}, и твоё мнение может быть не точным, не окончательным (писать это в явном виде нельзя). Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва)", 5),
-            "First_Impression_Moderately_Positive" : (f"Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть умеренно положительным, опиши свои положительные впечатления от покупки, но также укажи небольшие недостатки или аспекты, которые могли бы быть лучше. Сделай так, чтобы из текста было понятно, что ты только начал пользоваться товаром. Ты хочешь поставить этому товару рейтинг 4 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 4),
-            "First_Impression_Neutral": (f"Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть нейтральным, опиши как плюсы так и минусы товара которые ты заметил, но из текста должно быть понятно, что ты совсем недавно купил {product_name}, и твоё мнение может быть не точным, не окончательным (писать это в явном виде нельзя). Ты хочешь поставить этому товару рейтинг 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва) ", 3),
-            "First_Impression_Negative": (f'Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть негативным, отметь недостатки или проблемы, которые ты заметил при использовании товара. Также укажи, какие аспекты тебя разочаровали, но избегай чрезмерной критики, так как впечатление основано на коротком сроке использования (писать это в явном виде нельзя). Ты хочешь поставить этому товару рейтинг 2 из 5 (саму оценку не нужно указывать в тексте отзыва)',2),
-            "First_Impression_Strong_Negative": (f"Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть крайне негативным, опиши серьёзные недостатки и разочарования, которые ты испытал при использовании товара. Подчеркни, что тебе не понравилось и почему товар не оправдал ожидания. Ты хочешь поставить этому товару рейтинг 1 из 5 (саму оценку не нужно указывать в тексте отзыва)' ",1),
-            
-            # Цена Vs Качество
-            "Price_vs_Quality_Extra_Positive": (f"Напиши отзыв, основанный на подходе сравнения \"Цена/качество\", где купленный тобой товар - {product_name} бесспорно победил. Ты очень доволен своим выбором, Ты действительно считаешь, что качество товара превышает его стоимость (но не нужно писать об этом так прямо), пиши опосредованно, но так чтобы из контекста это было однозначно понятно. Ты хочешь поставить товару оценку 5 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 5),
-            "Price_vs_Quality_Positive": (f"Напиши отзыв на основе сравнения 'Цена/качество', где {product_name} в целом соответствует своей стоимости и оправдывает ожидания. В целом, ты доволен товаром, но также укажи, какие улучшения можно было бы внести, чтобы качество больше соответствовало цене. Ты хочешь поставить товару оценку 4 из 5 (саму оценку не нужно указывать в тексте отзыва). ", 4), #нужно чуть улучшить
-            "Price_vs_Quality_Normal": (f"Напиши отзыв, основанный на подходе сравнения \"Цена/качество\", где купленный тобой товар {product_name} адекватно соответствует своей цене, но не является \"топом за свои деньги\". То есть, в целом, товар нормальный и он оправдал твои ожидания. Ты хочешь поставить товару оценку 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва) ", 3),
-            "Price_vs_Quality_Mildly_Negative": (f"Напиши негативный отзыв, основанный на подходе сравнения \"Цена/качество\", где купленный тобой товар - {product_name} несколько разочаровал тебя. Ты считаешь, что цена завышена, а данный товар всё-таки не стоит своих денег. Но это должен быть умеренно негативный отзыв, в целом ты доволен покупкой, но осадок остался. Можешь сказать, что ты ожидал большего за эту цену (но не пиши прям так, используй другие формулировки). Ты хочешь поставить товару оценку 2 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 2),
-            "Price_vs_Quality_Strong_Negative": (f"Напиши негативный отзыв на основе сравнения \"Цена/качество\", где {product_name} совершенно не стоит своих денег. Укажи существенные недостатки и проблемы, которые сделали твою покупку разочаровывающей. Подчеркни, что ты ожидал гораздо большего за такую цену. Ты хочешь поставить товару оценку 1 из 5 (саму оценку не нужно указывать в тексте отзыва)", 1),
-            
-            # Рекомендации и подробности использования.
-            "Instructions_Recommendations": (f"Напиши отзыв, в котором будут содержаться рекомендации для других покупателей товара {product_name}. Это могут быть рекомендации по уходу, сборке, обслуживанию, установке, подбору цвета и тому подобное. Придумай что-то своё, включи \"эксперта\". Напиши несколько советов. Отзыв должен быть положительным, а совет не поверхностным, не общим. ", 5),
-            "Practical_Review": (f"Напиши практический отзыв, поделись подробностями: использования/сборки/ухода за {product_name}. (При этом нужно учитывать о каком товаре ты пишешь). Это должен быть положительный, хороший отзыв, но он должен включать твои советами или деталями по использованию данного товара в жизни. Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 5),
-            
-            # Отзыв после длительного времени использования
-            "Long_Term_Use_Extra_Positive": (f"Напиши отзыв, основанный на долгосрочном использовании товара {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). То есть ты данный товар купил давно, но только сейчас решился поделиться опытом. За это время ты оценил достоинства товара, и считаешь, что не прогадал с выбором.  Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 5),
-            "Long_Term_Use_Positive": (f"Напиши отзыв на основе долгосрочного использования товара {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). Опиши его положительные стороны, но также укажи аспекты, в которых можно было бы улучшить товар для ещё большего соответствия твоим ожиданиям. Покажи, что покупка товара в целом оправдала себя.  Ты хочешь поставить этому товару рейтинг 4 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 4),
-            "Long_Term_Use_Neutral": (f"Напиши отзыв, основанный на долгосрочном опыте использования {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). То есть ты приобрел товар давно, но только сейчас решился поделиться опытом, укажи плюсы и минусы товара которые ты выявил за долгое время использования. Ты хочешь поставить этому товару рейтинг 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва) ", 3),
-            "Long_Term_Use_Negative": (f"Напиши умеренно негативный отзыв на основе долгосрочного использования товара {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). Расскажи о недостатках или проблемах, которые стали заметными тебе со временем. Подчеркни, что первоначальное впечатление о товаре со временем ухудшилось, и ты больше не считаешь его хорошим вариантом для покупки. Ты хочешь поставить этому товару рейтинг 2 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 2),
-            "Long_Term_Use_Strong_Negative": (f"Напиши крайне отрицательный отзыв на основе долгосрочного использования товара {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). Опиши все существенные проблемы и недостатки (товар со временем сломался, износился, ухудшились его качества. Выбери что-то одного из этого, учитывая контекст того, о каком именно товаре ты пишешь отзыв), которые сделали длительное использование разочаровывающим. Объясни, почему ты категорически не рекомендуешь этот товар и считаешь, что он совсем не оправдывает свою цену. Ты хочешь поставить этому товару рейтинг 1 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 1),
-            
-            ## Не связанные с самим товаром
-            # Скорость доставки 
-            "Delivery_time_Extra_Positive": (f"{product_name} был доставлен в пункт выдачи заказов, гораздо раньше чем ты ожидал, и очень доволен тем, что так быстро получил свой товар. Отзыв должен быть очень кратким, и не затрагивать характеристики самого товара. Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва)", 5),
-            "Delivery_time_Positive": (f"Тебе пришлось долго ждать доставку {product_name} в ПВЗ, и хоть самим товаром ты доволен, долгая доставка немного разочаровала тебя. Отзыв должен быть достаточно кратким, ра Ты хочешь поставить этому товару рейтинг 4 из 5 только из за долгой доставки (саму оценку не нужно указывать в тексте отзыва) ",4),
-            "Delivery_time_Neutral": (f"Тебе пришлось долго ждать доставку {product_name} в ПВЗ, в принципе ты остался доволен самим товаром, но из-за долгой доставки немного разочаровался в своём выборе. Отзыв должен быть достаточно кратким, Ты хочешь поставить этому товару рейтинг 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва) ",3),
-            "Delivery_time_Negative": (f"Тебе пришлось очень долго ждать доставку {product_name} в ПВЗ (от 14 дней до 2 месяцев, сам придумай точное количество в днях и укажи его), из-за этого твоя покупка омрачена, поскольку ты мог заказать другой товар и уже давно получить его, напиши очень краткий но полный недовольства и возмущения отзыв. При этом не рассуждай на тему качества или цены товара. Ты хочешь поставить этому товару рейтинг 2 из 5 исключительно из за долгой доставки (саму оценку не нужно указывать в тексте отзыва) ", 2),
-            "Delivery_time_Strong_Negative": (f"Тебе пришлось очень долго ждать доставку {product_name} в ПВЗ (от 14 дней до 2 месяцев, сам придумай точное количество в днях и укажи его), при том что товар нужен был тебе срочно, ты крайне негативен и эмоционален при написании отзыва. Напиши очень краткий но полный недовольства и возмущения отзыв. При этом не рассуждай на тему качества или цены товара. Ты хочешь поставить этому товару рейтинг 1 из 5 исключительно из за долгой доставки (саму оценку не нужно указывать в тексте отзыва) ", 1),
-            
-            # Ситуации в ПВЗ
-            "Delivery_point_Extra_Positive": (f"Тебе удалось быстро забрать {product_name} из ПВЗ (там не было очереди), при этом с тобой очень мило общалась девушка выдающая заказы на ПВЗ, ты очень доволен своей покупкой, а данная ситуация подняла тебе настроение (не нужно писать об этом напрямую, попытайся передать это через контекст отзыва). Поэтому ты хочешь поставить товару рейтинг 5 из 5. (саму оценку не нужно указывать в тексте отзыва). Отзыв должен быть достаточно кратким.", 5),
-            "Delivery_point_Strong_Negative": (f"Когда ты пришёл забирать {product_name} из ПВЗ тебе нахамила девушка выдающая заказы, ты крайне рассержен и недоволен произошедшей ситуацией, она омрачила твою покупку. На эмоциях ты хочешь написать очень короткий но резкий негативный отзыв, при этом тебя уже не интересует сам товар, ты хочешь только изложить свой гнев относительно ситуации. Ты хочешь поставить товару рейтинг 1 из 5 исключительно из-за хамства. (саму оценку не нужно указывать в тексте отзыва).", 1),
-        }
+# Типы отзывов: ключ -> (шаблон текста с {product_name}, рейтинг)
+REVIEW_TYPES = {
+    # Эмоциональные
+    "Excited_Emotion": ("Напиши эмоциональный, восторженный отзыв. Поделись своими эмоциями и ощущениями от покупки {product_name}. Сделай большой упор на чувства, которые у тебя вызвала покупка. Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва)",5),
+    "Positive_Emotion": ("Напиши умеренно эмоциональный, положительный отзыв. Поделись эмоциями от покупки {product_name}. Сделай больший упор на чувства, которые у тебя вызвала покупка. Ты хочешь поставить этому товару рейтинг 4 из 5 (саму оценку не нужно указывать в тексте отзыва)",4),
+    "Neutral_Emotion": ('Напиши сбалансированный отзыв о {product_name}. Поделись своим мнением, выражая как положительные, так и отрицательные стороны покупки. Расскажи, какие аспекты тебя порадовали, а что не оправдало ожидания. Избегай чрезмерных эмоций и жалоб. Ты хочешь поставить этому товару рейтинг 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва)',3),
+    "Mildly_Negative_Emotion": ("Напиши эмоциональный, умеренно негативный отзыв. Такой отзыв, при котором была бы уместна оценка 2 из 5 баллов (саму оценку не нужно указывать в тексте отзыва). Опиши, что именно тебя разочаровало в {product_name}, и какие проблемы ты обнаружил. Пожалуйся, но не слишком переусердствуй. ", 2),
+    "Strong_Negative_Emotion": ("Напиши эмоциональный, негативный отзыв. Такой отзыв, при котором была бы уместна оценка 1 из 5 баллов (саму оценку не нужно указывать в тексте отзыва). Подчеркни серьёзные недостатки {product_name}, которые вызвали у тебя разочарование и недовольство, и объясни, почему этот товар совершенно не соответствует твоим ожиданиям. Чётко вырази свою неудовлетворённость и предостереги других от покупки. ", 1),
+
+    # Сравнения
+    "Positive_Analytics": ("Напиши аналитический отзыв: как ты сравнивал {product_name} с другими товарами аналогами. Скажи конкретно, в чём было это сравнение, на что именно ты обращал внимание в первую очередь. И итогом должно стать то, что в результате тщательного отбора и долгого сравнения выбор пал на {product_name}, и ты не жалеешь о своем выборе, наоборот, рад что купил именно {product_name}. Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 5),
+    "Equal_Analytics": ("Напиши аналитический отзыв: как ты сравнивал {product_name} с другими товарами аналогами. Скажи конкретно, в чём было это сравнение, на что именно ты обращал внимание в первую очередь. По итогу ты считаешь, что купил хороший товар - {product_name}, но и у других, схожих товаров были свои преимущества (скажи какие именно). То есть, ты в целом доволен покупкой, но предлагаешь другим покупателям рассмотреть и другие варианты к покупке. Ты хочешь поставить этому товару рейтинг 4 из 5 (саму оценку не нужно указывать в тексте отзыва)", 4),
     
-    if rating_preference == 'balanced':
-        # Вероятности выбора того или иного рейтинга (E=4,775)
-        review_types = {'1': 0.005, '2': 0.015, '3': 0.03, '4': 0.10, '5': 0.85}
-        chosen_rating = random.choices(list(review_types.keys()), list(review_types.values()), k=1)[0]
-        
-        # Фильтруем типы отзывов по выбранному рейтингу
-        filtered_types = {key: val for key, val in type_variations.items() if val[1] == int(chosen_rating)}
-    if rating_preference == 'positive':
-        filtered_types = {key: val for key, val in type_variations.items() if val[1] >= 4}
-    elif rating_preference == 'neutral':
-        filtered_types = {key: val for key, val in type_variations.items() if val[1] == 3}
-    elif rating_preference == 'negative':
-        filtered_types = {key: val for key, val in type_variations.items() if val[1] <= 2}
+    # Первое впечатление
+    "First_Impression_Positive":("Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть положительным . Но из текста должно быть понятно, что ты совсем недавно купил {product_name}, и твоё мнение может быть не точным, не окончательным (писать это в явном виде нельзя). Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва)", 5),
+    "First_Impression_Moderately_Positive" : ("Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть умеренно положительным, опиши свои положительные впечатления от покупки, но также укажи небольшие недостатки или аспекты, которые могли бы быть лучше. Сделай так, чтобы из текста было понятно, что ты только начал пользоваться товаром. Ты хочешь поставить этому товару рейтинг 4 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 4),
+    "First_Impression_Neutral": ("Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть нейтральным, опиши как плюсы так и минусы товара которые ты заметил, но из текста должно быть понятно, что ты совсем недавно купил {product_name}, и твоё мнение может быть не точным, не окончательным (писать это в явном виде нельзя). Ты хочешь поставить этому товару рейтинг 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва) ", 3),
+    "First_Impression_Negative": ('Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть негативным, отметь недостатки или проблемы, которые ты заметил при использовании товара. Также укажи, какие аспекты тебя разочаровали, но избегай чрезмерной критики, так как впечатление основано на коротком сроке использования (писать это в явном виде нельзя). Ты хочешь поставить этому товару рейтинг 2 из 5 (саму оценку не нужно указывать в тексте отзыва)',2),
+    "First_Impression_Strong_Negative": ("Напиши отзыв на основе первого впечатления от {product_name}. Представь, что ты используешь товар совсем недавно (1-2 дня). Отзыв должен быть крайне негативным, опиши серьёзные недостатки и разочарования, которые ты испытал при использовании товара. Подчеркни, что тебе не понравилось и почему товар не оправдал ожидания. Ты хочешь поставить этому товару рейтинг 1 из 5 (саму оценку не нужно указывать в тексте отзыва)' ",1),
+    
+    # Цена Vs Качество
+    "Price_vs_Quality_Extra_Positive": ("Напиши отзыв, основанный на подходе сравнения \"Цена/качество\", где купленный тобой товар - {product_name} бесспорно победил. Ты очень доволен своим выбором, Ты действительно считаешь, что качество товара превышает его стоимость (но не нужно писать об этом так прямо), пиши опосредованно, но так чтобы из контекста это было однозначно понятно. Ты хочешь поставить товару оценку 5 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 5),
+    "Price_vs_Quality_Positive": ("Напиши отзыв на основе сравнения 'Цена/качество', где {product_name} в целом соответствует своей стоимости и оправдывает ожидания. В целом, ты доволен товаром, но также укажи, какие улучшения можно было бы внести, чтобы качество больше соответствовало цене. Ты хочешь поставить товару оценку 4 из 5 (саму оценку не нужно указывать в тексте отзыва). ", 4), #нужно чуть улучшить
+    "Price_vs_Quality_Normal": ("Напиши отзыв, основанный на подходе сравнения \"Цена/качество\", где купленный тобой товар {product_name} адекватно соответствует своей цене, но не является \"топом за свои деньги\". То есть, в целом, товар нормальный и он оправдал твои ожидания. Ты хочешь поставить товару оценку 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва) ", 3),
+    "Price_vs_Quality_Mildly_Negative": ("Напиши негативный отзыв, основанный на подходе сравнения \"Цена/качество\", где купленный тобой товар - {product_name} несколько разочаровал тебя. Ты считаешь, что цена завышена, а данный товар всё-таки не стоит своих денег. Но это должен быть умеренно негативный отзыв, в целом ты доволен покупкой, но осадок остался. Можешь сказать, что ты ожидал большего за эту цену (но не пиши прям так, используй другие формулировки). Ты хочешь поставить товару оценку 2 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 2),
+    "Price_vs_Quality_Strong_Negative": ("Напиши негативный отзыв на основе сравнения \"Цена/качество\", где {product_name} совершенно не стоит своих денег. Укажи существенные недостатки и проблемы, которые сделали твою покупку разочаровывающей. Подчеркни, что ты ожидал гораздо большего за такую цену. Ты хочешь поставить товару оценку 1 из 5 (саму оценку не нужно указывать в тексте отзыва)", 1),
     
-    chosen_key = random.choice(list(filtered_types.keys()))
+    # Рекомендации и подробности использования.
+    "Instructions_Recommendations": ("Напиши отзыв, в котором будут содержаться рекомендации для других покупателей товара {product_name}. Это могут быть рекомендации по уходу, сборке, обслуживанию, установке, подбору цвета и тому подобное. Придумай что-то своё, включи \"эксперта\". Напиши несколько советов. Отзыв должен быть положительным, а совет не поверхностным, не общим. ", 5),
+    "Practical_Review": ("Напиши практический отзыв, поделись подробностями: использования/сборки/ухода за {product_name}. (При этом нужно учитывать о каком товаре ты пишешь). Это должен быть положительный, хороший отзыв, но он должен включать твои советами или деталями по использованию данного товара в жизни. Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 5),
+    
+    # Отзыв после длительного времени использования
+    "Long_Term_Use_Extra_Positive": ("Напиши отзыв, основанный на долгосрочном использовании товара {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). То есть ты данный товар купил давно, но только сейчас решился поделиться опытом. За это время ты оценил достоинства товара, и считаешь, что не прогадал с выбором.  Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 5),
+    "Long_Term_Use_Positive": ("Напиши отзыв на основе долгосрочного использования товара {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). Опиши его положительные стороны, но также укажи аспекты, в которых можно было бы улучшить товар для ещё большего соответствия твоим ожиданиям. Покажи, что покупка товара в целом оправдала себя.  Ты хочешь поставить этому товару рейтинг 4 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 4),
+    "Long_Term_Use_Neutral": ("Напиши отзыв, основанный на долгосрочном опыте использования {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). То есть ты приобрел товар давно, но только сейчас решился поделиться опытом, укажи плюсы и минусы товара которые ты выявил за долгое время использования. Ты хочешь поставить этому товару рейтинг 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва) ", 3),
+    "Long_Term_Use_Negative": ("Напиши умеренно негативный отзыв на основе долгосрочного использования товара {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). Расскажи о недостатках или проблемах, которые стали заметными тебе со временем. Подчеркни, что первоначальное впечатление о товаре со временем ухудшилось, и ты больше не считаешь его хорошим вариантом для покупки. Ты хочешь поставить этому товару рейтинг 2 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 2),
+    "Long_Term_Use_Strong_Negative": ("Напиши крайне отрицательный отзыв на основе долгосрочного использования товара {product_name} (длительный опыт использования должен быть понятен из контекста отзыва). Опиши все существенные проблемы и недостатки (товар со временем сломался, износился, ухудшились его качества. Выбери что-то одного из этого, учитывая контекст того, о каком именно товаре ты пишешь отзыв), которые сделали длительное использование разочаровывающим. Объясни, почему ты категорически не рекомендуешь этот товар и считаешь, что он совсем не оправдывает свою цену. Ты хочешь поставить этому товару рейтинг 1 из 5 (саму оценку не нужно указывать в тексте отзыва) ", 1),
+    
+    ## Не связанные с самим товаром
+    # Скорость доставки 
+    "Delivery_time_Extra_Positive": ("{product_name} был доставлен в пункт выдачи заказов, гораздо раньше чем ты ожидал, и очень доволен тем, что так быстро получил свой товар. Отзыв должен быть очень кратким, и не затрагивать характеристики самого товара. Ты хочешь поставить этому товару рейтинг 5 из 5 (саму оценку не нужно указывать в тексте отзыва)", 5),
+    "Delivery_time_Positive": ("Тебе пришлось долго ждать доставку {product_name} в ПВЗ, и хоть самим товаром ты доволен, долгая доставка немного разочаровала тебя. Отзыв должен быть достаточно кратким, ра Ты хочешь поставить этому товару рейтинг 4 из 5 только из за долгой доставки (саму оценку не нужно указывать в тексте отзыва) ",4),
+    "Delivery_time_Neutral": ("Тебе пришлось долго ждать доставку {product_name} в ПВЗ, в принципе ты остался доволен самим товаром, но из-за долгой доставки немного разочаровался в своём выборе. Отзыв должен быть достаточно кратким, Ты хочешь поставить этому товару рейтинг 3 из 5, то есть отзыв должен быть нейтральным (саму оценку не нужно указывать в тексте отзыва) ",3),
+    "Delivery_time_Negative": ("Тебе пришлось очень долго ждать доставку {product_name} в ПВЗ (от 14 дней до 2 месяцев, сам придумай точное количество в днях и укажи его), из-за этого твоя покупка омрачена, поскольку ты мог заказать другой товар и уже давно получить его, напиши очень краткий но полный недовольства и возмущения отзыв. При этом не рассуждай на тему качества или цены товара. Ты хочешь поставить этому товару рейтинг 2 из 5 исключительно из за долгой доставки (саму оценку не нужно указывать в тексте отзыва) ", 2),
+    "Delivery_time_Strong_Negative": ("Тебе пришлось очень долго ждать доставку {product_name} в ПВЗ (от 14 дней до 2 месяцев, сам придумай точное количество в днях и укажи его), при том что товар нужен был тебе срочно, ты крайне негативен и эмоционален при написании отзыва. Напиши очень краткий но полный недовольства и возмущения отзыв. При этом не рассуждай на тему качества или цены товара. Ты хочешь поставить этому товару рейтинг 1 из 5 исключительно из за долгой доставки (саму оценку не нужно указывать в тексте отзыва) ", 1),
+    
+    # Ситуации в ПВЗ
+    "Delivery_point_Extra_Positive": ("Тебе удалось быстро забрать {product_name} из ПВЗ (там не было очереди), при этом с тобой очень мило общалась девушка выдающая заказы на ПВЗ, ты очень доволен своей покупкой, а данная ситуация подняла тебе настроение (не нужно писать об этом напрямую, попытайся передать это через контекст отзыва). Поэтому ты хочешь поставить товару рейтинг 5 из 5. (саму оценку не нужно указывать в тексте отзыва). Отзыв должен быть достаточно кратким.", 5),
+    "Delivery_point_Strong_Negative": ("Когда ты пришёл забирать {product_name} из ПВЗ тебе нахамила девушка выдающая заказы, ты крайне рассержен и недоволен произошедшей ситуацией, она омрачила твою покупку. На эмоциях ты хочешь написать очень короткий но резкий негативный отзыв, при этом тебя уже не интересует сам товар, ты хочешь только изложить свой гнев относительно ситуации. Ты хочешь поставить товару рейтинг 1 из 5 исключительно из-за хамства. (саму оценку не нужно указывать в тексте отзыва).", 1),
+}
+
+# Шаблоны типов отзывов, сгруппированные по рейтингу (строятся один раз при импорте модуля)
+REVIEW_TYPES_BY_RATING = MappingProxyType({
+    rating: tuple(template for template, template_rating in REVIEW_TYPES.values() if template_rating == rating)
+    for rating in range(1, 6)
+})
+
+# Шаблоны (вместе с рейтингом) для предпочтений по рейтингу
+REVIEW_TYPES_BY_PREFERENCE = MappingProxyType({
+    'positive': tuple(item for item in REVIEW_TYPES.values() if item[1] >= 4),
+    'neutral': tuple(item for item in REVIEW_TYPES.values() if item[1] == 3),
+    'negative': tuple(item for item in REVIEW_TYPES.values() if item[1] <= 2),
+})
+
+# Вероятности выбора того или иного рейтинга в сбалансированном режиме (E=4,775)
+BALANCED_RATINGS = (1, 2, 3, 4, 5)
+BALANCED_CUM_WEIGHTS = tuple(accumulate((0.005, 0.015, 0.03, 0.10, 0.85)))
+
+# Выбор типа отзыва (название товара подставляется только в выбранный шаблон)
+def get_review_type(product_name, rating_preference):
+    if rating_preference == 'balanced':
+        rating = random.choices(BALANCED_RATINGS, cum_weights=BALANCED_CUM_WEIGHTS, k=1)[0]
+        template = random.choice(REVIEW_TYPES_BY_RATING[rating])
+    else:
+        template, rating = random.choice(REVIEW_TYPES_BY_PREFERENCE[rating_preference])
     
-    return filtered_types[chosen_key][0], filtered_types[chosen_key][1]
+    return template.format(product_name=product_name), rating
 
 # Промпт для создания ситуаций
 def create_situation(sex, profession, income, marital_status, children, hobby, product_info):
@@ -265,13 +357,25 @@ def create_situation(sex, profession, income, marital_status, children, hobby, p
     "Но не пиши так '1. Ситуация', просто пиши цифру с точкой а потом описывай саму ситуацию. Сам Wildberries упоминать в сценариях не нужно."
     )
 
-# Требования к грамматике 
-def get_grammar_instruct():
+# Промпт для создания ситуаций, общих для кластера покупателей (без профессии, дохода и увлечения)
+def create_cluster_situation(sex, marital_status, children, product_info):
     return (
+    f"Представь что ты {sex}. Ты {marital_status}, и у тебя {children}. "
+    "Теперь тебе нужно представить 10 разных ситуаций (и очень кратко описать их), при которых ты бы мог(могла) заказать данный товар на маркетплейсе Wildberries: "
+    f"{product_info} "
+    "Ситуации должны быть максимально естественными для тебя и не должны зависеть от профессии, дохода или увлечений. "
+    "Но не пиши так '1. Ситуация', просто пиши цифру с точкой а потом описывай саму ситуацию. Сам Wildberries упоминать в сценариях не нужно."
+    )
+
+# Требования к грамматике 
+GRAMMAR_INSTRUCT = (
     "Пиши грамотно, как-будто ты родился и живешь в России и русский твой родной язык. "
     "Не используй сложносочинённые предложения, не используй редкие слова, не используй хитрые деепричастные обороты. "
     "Напротив, старайся писать просто, понятно - как пишет обычный грамотный человек, который хорошо учился в школе. "
-    )
+)
+
+def get_grammar_instruct():
+    return GRAMMAR_INSTRUCT
 
 # Требования к фактам
 def get_facts(product_name):
@@ -279,4 +383,76 @@ def get_facts(product_name):
     "Не фантазируй по поводу характеристик и свойств товара. То, что ты пишешь, должно полностью проходить фактчекинг. "
     "Следовательно, если ты чего-то не знаешь, то не пиши об этом, чтобы не вводить других покупателей в заблуждение. "
     f"Отталкивайся от названия и известных тебе характеристик товара {product_name}, но не пиши отсебятины, которая может оказаться не верна."
-    )
\ No newline at end of file
+    )
+
+# Промпт для создания ситуаций, в котором описание товара идет первым (общий префикс для всех покупателей)
+def create_situation_product_first(sex, profession, income, marital_status, children, hobby, product_info):
+    return (
+    f"Товар на маркетплейсе Wildberries: {product_info} "
+    "Тебе нужно представить 10 ситуаций (и очень кратко описать их), при которых ты бы мог(могла) заказать этот товар. "
+    "При этом если твоя профессия и твое хобби не сильно относятся к покупаемому товару, не нужно пытаться выдумывать ситуацию исходя из профессии и хобби"
+    "Ситуации должны быть максимально естественными для тебя"
+    "Но не пиши так '1. Ситуация', просто пиши цифру с точкой а потом описывай саму ситуацию. Сам Wildberries упоминать в сценариях не нужно. "
+    f"Представь что ты {sex}, твоя профессия - {profession}, твоя заработная плата составляет {income}. "
+    f"Ты {marital_status}, и у тебя {children}, а твоё увлечение - {hobby}."
+    )
+
+# Промпт для создания ситуаций, общих для кластера покупателей, в котором описание товара идет первым
+def create_cluster_situation_product_first(sex, marital_status, children, product_info):
+    return (
+    f"Товар на маркетплейсе Wildberries: {product_info} "
+    "Тебе нужно представить 10 разных ситуаций (и очень кратко описать их), при которых ты бы мог(могла) заказать этот товар. "
+    "Ситуации должны быть максимально естественными для тебя и не должны зависеть от профессии, дохода или увлечений. "
+    "Но не пиши так '1. Ситуация', просто пиши цифру с точкой а потом описывай саму ситуацию. Сам Wildberries упоминать в сценариях не нужно. "
+    f"Представь что ты {sex}. Ты {marital_status}, и у тебя {children}."
+    )
+
+# Варианты расположения разделов в итоговом промпте:
+# classic - исходный порядок разделов,
+# prefix - все разделы товара и общие инструкции идут первыми (неизменный префикс для кэширования промптов
+# на стороне провайдера), а разделы конкретного отзыва - в конце
+PROMPT_LAYOUTS = ('classic', 'prefix')
+
+class PromptTemplate:
+    """Скомпилированный шаблон итогового промпта для одного товара.
+    
+    Разделы, зависящие только от товара, собираются один раз на всю генерацию,
+    а для каждого отзыва подставляются только профиль покупателя, ситуация,
+    тип отзыва и инструкция со смайликами.
+    """
+    
+    __slots__ = ('product_name', 'product_info', 'layout', 'head', 'additionally', 'additionally_emoji', 'tail')
+    
+    def __init__(self, product_name, product_info, layout='classic'):
+        if layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Неизвестный вариант расположения разделов промпта: {layout}")
+        self.product_name = product_name
+        self.product_info = product_info
+        self.layout = layout
+        self.head = f"{get_task_deskr(product_name)}{get_product_charact(product_info)}{get_review_prescription(product_name)}"
+        self.tail = f"{GRAMMAR_INSTRUCT}{get_facts(product_name)}"
+        if layout == 'prefix':
+            self.head = f"{self.head}{ADDITIONALLY_BASE} {self.tail} "
+            self.additionally = ""
+            self.additionally_emoji = f" {EMOJI_INSTRUCTION}"
+            self.tail = ""
+        else:
+            self.additionally = get_additionally(with_emoji=False)
+            self.additionally_emoji = get_additionally(with_emoji=True)
+    
+    def render(self, reviewer_profile, situation, review_type, with_emoji=False):
+        additionally = self.additionally_emoji if with_emoji else self.additionally
+        if self.layout == 'prefix':
+            return f"{self.head}{reviewer_profile}{situation}{review_type}{additionally}"
+        return f"{self.head}{reviewer_profile}{situation}{additionally}{review_type}{self.tail}"
+    
+    def situation_prompt(self, sex, profession, income, marital_status, children, hobby):
+        if self.layout == 'prefix':
+            return create_situation_product_first(sex, profession, income, marital_status, children, hobby, self.product_info)
+        return create_situation(sex, profession, income, marital_status, children, hobby, self.product_info)
+    
+    def cluster_situation_prompt(self, sex, profession, income, marital_status, children, hobby):
+        # Для пула сценариев: в промпт входят только поля кластера покупателей (см. persona_cluster)
+        if self.layout == 'prefix':
+            return create_cluster_situation_product_first(sex, marital_status, children, self.product_info)
+        return create_cluster_situation(sex, marital_status, children, self.product_info)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import random
+import time
+import openai
+import metrics
+
+# Лимиты запросов (rpm) и токенов (tpm) в минуту для моделей OpenAI (первый уровень доступа,
+# для других уровней переопределяются через parse_model_limits)
+MODEL_LIMITS = {
+    'gpt-4o-mini': {'rpm': 500, 'tpm': 200000},
+    'gpt-3.5-turbo-0125': {'rpm': 500, 'tpm': 200000},
+    'gpt-4o': {'rpm': 500, 'tpm': 30000},
+}
+
+# Лимиты для моделей, которых нет в MODEL_LIMITS
+DEFAULT_LIMITS = {'rpm': 500, 'tpm': 30000}
+
+def parse_model_limits(value, defaults=MODEL_LIMITS):
+    """Функция возвращает лимиты моделей defaults, переопределенные строкой вида "gpt-4o-mini=5000:2000000,gpt-4o=500:30000" (rpm:tpm)."""
+
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        model_name, _, model_limits = item.partition('=')
+        rpm, _, tpm = model_limits.partition(':')
+        try:
+            limits[model_name.strip()] = {'rpm': int(rpm), 'tpm': int(tpm)}
+        except ValueError:
+            raise ValueError(f"Неверный формат лимитов модели (ожидается модель=rpm:tpm): {item}") from None
+    return limits
+
+class TokenBucket:
+    """Ведро токенов: не более capacity единиц, пополняется равномерно со скоростью rate в секунду."""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount):
+        """Асинхронный метод, ожидающий, пока в ведре наберется amount единиц (ожидающие обслуживаются по очереди)."""
+
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, delta):
+        """Метод для корректировки списанного количества после того, как стал известен реальный расход."""
+
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+class AdaptiveConcurrency:
+    """Адаптивный лимит одновременных запросов (AIMD).
+
+    После каждого успешного запроса лимит растет на 1/limit (то есть примерно на единицу
+    за каждые limit запросов), а при ошибке перегрузки уменьшается вдвое (не чаще раза в секунду).
+    Прочие ошибки (например, 400 и 401) ничего не говорят о нагрузке и лимит не меняют.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            while self.in_flight >= int(self.limit):
+                await self._condition.wait()
+            self.in_flight += 1
+
+    async def release(self, throttled=False, succeeded=True):
+        async with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self.last_decrease >= 1:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = now
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+class ModelLimiter:
+    """Лимиты одной модели: запросы в минуту, токены в минуту и число одновременных запросов."""
+
+    def __init__(self, rpm, tpm, initial_concurrency=8, max_concurrency=64):
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, 1, max_concurrency)
+
+def is_retryable(error):
+    """Функция определяет, стоит ли повторить запрос (перегрузка 429, ошибки сервера 5xx и сбои соединения)."""
+
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+def get_retry_after(error):
+    """Функция возвращает время ожидания из заголовка retry-after ответа (если он есть)."""
+
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """Общий на процесс ограничитель запросов к API с повторами и адаптивной параллельностью."""
+
+    def __init__(self, limits=None, initial_concurrency=8, max_concurrency=64, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.limits = MODEL_LIMITS if limits is None else limits
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._models = {}
+
+    def get_model_limiter(self, model_name):
+        limiter = self._models.get(model_name)
+        if limiter is None:
+            limits = self.limits.get(model_name, DEFAULT_LIMITS)
+            limiter = ModelLimiter(limits['rpm'], limits['tpm'], self.initial_concurrency, self.max_concurrency)
+            self._models[model_name] = limiter
+        return limiter
+
+    def backoff(self, attempt):
+        """Метод возвращает задержку перед повтором: экспоненциальная с полным случайным разбросом."""
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, model_name, estimated_tokens, request):
+        """Асинхронный метод для выполнения запроса request() с учетом лимитов модели.
+
+        При ошибках 429/5xx запрос повторяется с экспоненциальной задержкой, а лимит
+        одновременных запросов к модели уменьшается. После ответа списанная оценка
+        токенов заменяется реальным расходом из поля usage.
+        """
+
+        limiter = self.get_model_limiter(model_name)
+        attempt = 0
+        while True:
+            await limiter.concurrency.acquire()
+            throttled = False
+            succeeded = False
+            try:
+                await limiter.requests.acquire(1)
+                await limiter.tokens.acquire(estimated_tokens)
+                response = await request()
+            except Exception as e:
+                throttled = is_retryable(e)
+                if not throttled or attempt >= self.max_retries:
+                    metrics.inc('openai_failures')
+                    raise
+                metrics.inc('openai_retries')
+                delay = get_retry_after(e)
+            else:
+                succeeded = True
+                delay = None
+            finally:
+                # Неповторяемые ошибки и отмена запроса не меняют лимит одновременных запросов
+                await limiter.concurrency.release(throttled=throttled, succeeded=succeeded)
+
+            if throttled:
+                await asyncio.sleep(self.backoff(attempt) if delay is None else delay)
+                attempt += 1
+                continue
+
+            metrics.observe(f'openai_concurrency_limit_{model_name}', limiter.concurrency.limit)
+            usage = getattr(response, 'usage', None)
+            if usage is not None and usage.total_tokens:
+                limiter.tokens.adjust(usage.total_tokens - estimated_tokens)
+            return response
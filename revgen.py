@@ -1,41 +1,194 @@
 import asyncio
 import random
-import pandas as pd
 import sys
 import os
-import json
-import io
-import xml.etree.ElementTree as ET
+import time
+from collections import namedtuple
 from dotenv import load_dotenv
+import httpx
 import openai
 from openai import AsyncOpenAI
+from openai.types import CompletionUsage
 import selectors
-import aiosqlite
+import storage
 from wbparser import get_product_info
 import preprompt as pp
+import metrics
+from ratelimit import RateLimiter, parse_model_limits
+from cache import CompletionCache, completion_key
+from export import export_rows
+from scenarios import ScenarioPool, FALLBACK_SCENARIO, parse_all_scenarios
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Загрузка пути к базе данных
-DB_PATH = os.getenv('DB_PATH')
+# Размер пула HTTP-соединений с API OpenAI
+OPENAI_POOL_SIZE = int(os.getenv('OPENAI_POOL_SIZE', 20))
+
+# Общий на весь процесс клиент OpenAI и его HTTP-клиент (создаются при запуске бота)
+_client = None
+_http_client = None
+
+# Отслеживание установки новых TCP-соединений (для расчета доли переиспользованных соединений)
+async def _trace_connection(event_name, info):
+    if event_name == 'connection.connect_tcp.complete':
+        metrics.inc('openai_connections_opened')
+
+async def _on_request(request):
+    metrics.inc('openai_http_requests')
+    request.extensions['trace'] = _trace_connection
+
+# Создание общего клиента OpenAI с пулом соединений
+async def init_client(pool_size=OPENAI_POOL_SIZE):
+    global _client, _http_client
+    if _client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=60),
+            timeout=httpx.Timeout(120, connect=10),
+            event_hooks={'request': [_on_request]},
+        )
+        # Повторы запросов выполняет rate_limiter, поэтому встроенные повторы клиента отключены
+        _client = openai.AsyncClient(api_key=os.getenv("OPENAI_API_KEY"), http_client=_http_client, max_retries=0)
+    return _client
+
+# Закрытие общего клиента OpenAI при остановке бота
+async def close_client():
+    global _client, _http_client
+    if _client is not None:
+        await _client.close()
+    _client = None
+    _http_client = None
+
+# Статистика пула соединений: число открытых соединений и доля переиспользованных
+def get_pool_stats():
+    pool = getattr(getattr(_http_client, '_transport', None), '_pool', None)
+    connections = getattr(pool, 'connections', [])
+    requests = metrics.counters['openai_http_requests']
+    opened = metrics.counters['openai_connections_opened']
+    return {
+        'open_connections': len(connections),
+        'idle_connections': sum(1 for connection in connections if connection.is_idle()),
+        'requests': requests,
+        'connections_opened': opened,
+        'reuse_ratio': 1 - opened / requests if requests else None,
+    }
 
 # Авторизация по API ключу
 async def authorization():
-    client = openai.AsyncClient(api_key=os.getenv("OPENAI_API_KEY"))
-    return client
+    return await init_client()
 
-# Функция для получения ответов от модели
-async def get_model_responses(prompt, model_name):
-    client = await authorization()
+# Общий ограничитель запросов к API OpenAI (лимиты запросов и токенов в минуту для каждой модели)
+rate_limiter = RateLimiter(
+    limits=parse_model_limits(os.getenv('OPENAI_MODEL_LIMITS')),
+    initial_concurrency=int(os.getenv('OPENAI_CONCURRENCY', 8)),
+    max_concurrency=int(os.getenv('OPENAI_MAX_CONCURRENCY', 64)),
+)
+
+# Пул сценариев покупки: off - запрос сценариев для каждого отзыва, memory - пул в памяти процесса,
+# db - пул в базе данных, общий для всех генераций по одному товару
+SCENARIO_POOL = os.getenv('SCENARIO_POOL', 'db')
+# Время хранения сценария в пуле (после изменения карточки товара старые сценарии со временем вытесняются новыми)
+SCENARIO_POOL_TTL = int(os.getenv('SCENARIO_POOL_TTL', 24 * 3600))
+# Максимальное время ожидания сценариев от модели для пула (остальные отзывы того же кластера ждут этот запрос)
+SCENARIO_PRODUCE_TIMEOUT = float(os.getenv('SCENARIO_PRODUCE_TIMEOUT', 120))
+scenario_pool = ScenarioPool(persist=SCENARIO_POOL == 'db', ttl=SCENARIO_POOL_TTL,
+                             produce_timeout=SCENARIO_PRODUCE_TIMEOUT) if SCENARIO_POOL != 'off' else None
+
+# Расположение разделов итогового промпта (classic или prefix, см. preprompt.PROMPT_LAYOUTS)
+PROMPT_LAYOUT = os.getenv('PROMPT_LAYOUT', 'classic')
+
+# Максимальная длина ответа модели в токенах
+MAX_TOKENS = 1000
+
+# Грубая оценка числа токенов запроса (для русского текста около 2 символов на токен) с учетом длины ответа
+def estimate_tokens(prompt, max_tokens=MAX_TOKENS):
+    return len(prompt) // 2 + max_tokens
+
+# Потоковое получение ответов модели (позволяет замерить время до первого токена ответа)
+OPENAI_STREAM = os.getenv('OPENAI_STREAM', 'false').lower() in ('1', 'true', 'yes')
+
+# Ответ модели: текст и расход токенов
+Completion = namedtuple('Completion', ['content', 'usage'])
+
+# Запрос к модели: обычный или потоковый (во втором случае ответ собирается из частей по мере их поступления)
+async def create_completion(client, prompt, model_name, stream=False):
+    if not stream:
+        response = await client.chat.completions.create(
+            model=model_name,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=MAX_TOKENS,
+            temperature=1
+        )
+        return Completion(response.choices[0].message.content, response.usage)
+
+    started = time.perf_counter()
+    first_token = True
+    parts = []
+    usage = None
     response = await client.chat.completions.create(
         model=model_name,
         messages=[{"role": "user", "content": prompt}],
-        max_tokens=1000,
-        temperature=1
+        max_tokens=MAX_TOKENS,
+        temperature=1,
+        stream=True,
+        # Параметр передается в теле запроса: в используемой версии клиента openai аргумента stream_options нет
+        extra_body={"stream_options": {"include_usage": True}}
     )
+    async for chunk in response:
+        # Расход токенов приходит в последней части ответа (без вариантов ответа);
+        # в используемой версии клиента у части ответа нет поля usage, поэтому оно приходит словарем
+        chunk_usage = getattr(chunk, 'usage', None)
+        if chunk_usage is not None:
+            usage = CompletionUsage.model_validate(chunk_usage) if isinstance(chunk_usage, dict) else chunk_usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first_token:
+                metrics.observe('openai_ttft_seconds', time.perf_counter() - started)
+                first_token = False
+            parts.append(chunk.choices[0].delta.content)
+    return Completion(''.join(parts), usage)
+
+# Кэш ответов модели: off - отключен, situations - только запросы сценариев покупки, all - все запросы к модели
+COMPLETION_CACHE = os.getenv('COMPLETION_CACHE', 'off')
+completion_cache = CompletionCache(
+    maxsize=int(os.getenv('COMPLETION_CACHE_SIZE', 1000)),
+    max_bytes=int(os.getenv('COMPLETION_CACHE_BYTES', 16 * 1024 * 1024)),
+    ttl=int(os.getenv('COMPLETION_CACHE_TTL', 24 * 3600)),
+) if COMPLETION_CACHE != 'off' else None
+
+# Запрос к модели с учетом лимитов (возвращает текст ответа и число израсходованных токенов)
+async def request_model_response(prompt, model_name, stream=None):
+    client = await authorization()
+    if stream is None:
+        stream = OPENAI_STREAM
+    with metrics.timer('openai_response_seconds'):
+        completion = await rate_limiter.call(model_name, estimate_tokens(prompt), lambda: create_completion(client, prompt, model_name, stream))
+    record_usage(completion.usage)
+
+    return completion.content, completion.usage.total_tokens if completion.usage is not None else 0
+
+# Функция для получения ответов от модели (use_cache=True - ответ на такой же промпт может быть взят из кэша)
+async def get_model_responses(prompt, model_name, stream=None, use_cache=False):
+    if use_cache and completion_cache is not None:
+        key = completion_key(model_name, prompt, max_tokens=MAX_TOKENS, temperature=1)
+        return await completion_cache.get_or_create(key, lambda: request_model_response(prompt, model_name, stream))
+
+    content, _ = await request_model_response(prompt, model_name, stream)
+    return content
 
-    return response.choices[0].message.content
+# Учет израсходованных токенов, в том числе закэшированных на стороне провайдера токенов промпта
+def record_usage(usage):
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    if isinstance(details, dict):
+        cached_tokens = details.get('cached_tokens') or 0
+    else:
+        cached_tokens = getattr(details, 'cached_tokens', None) or 0
+    metrics.inc('openai_requests')
+    metrics.inc('openai_prompt_tokens', usage.prompt_tokens)
+    metrics.inc('openai_completion_tokens', usage.completion_tokens)
+    metrics.inc('openai_cached_tokens', cached_tokens)
+    metrics.observe('openai_cached_token_ratio', cached_tokens / usage.prompt_tokens if usage.prompt_tokens else 0)
 
 # Функция для преобразования характеристик в более читаемый для модели вид
 def get_char_prompt(product_data):
@@ -54,54 +207,45 @@ def get_char_prompt(product_data):
 
 # Функция извлечения сценариев из ответа модели и выбора случайного сценария
 async def parse_scenarios(data):
-    # Разбивка текста на строки
-    lines = data.split('\n')
-    
-    # Словарь для хранения сценариев
-    scenarios_dict = {"0": "Придумай сценарий сам"}
-    
-    current_key = None
-    current_text = []
-    
-    for line in lines:
-        if line.startswith(tuple(f"{i}." for i in range(1, 11))):
-            if current_key:
-                scenarios_dict[current_key] = ' '.join(current_text).strip()
-                current_text = []
-            current_key = line.split('.')[0]
-            current_text.append(line[len(current_key) + 2:])
-        else:
-            current_text.append(line)
-    
-    if current_key:
-        scenarios_dict[current_key] = ' '.join(current_text).strip()
-    
-    return random.choice(list(scenarios_dict.values()))
-
-# Функция создания итогового промпта
-async def build_prompt(product_id, id_gen, rating_preference, gender_preference, model_name="gpt-4o-mini"):
-    product_data = await get_product_info(product_id)
-    product_info = get_char_prompt(product_data)
-    product_name = product_data['наименование_товара']
-    sex, profession, income, marital_status, children, hobby = pp.who_am_i(gender_preference)
-
-    task_descr = pp.get_task_deskr(product_name)
-    product_charact = pp.get_product_charact(product_info)
-    review_prescription = pp.get_review_prescription(product_name)
+    return random.choice([FALLBACK_SCENARIO, *parse_all_scenarios(data)])
+
+# Функция компиляции шаблона промпта для товара
+def compile_prompt(product_data, layout=None):
+    return pp.PromptTemplate(product_data['наименование_товара'], get_char_prompt(product_data), layout or PROMPT_LAYOUT)
+
+# Функция создания итогового промпта (данные о товаре передаются уже полученными)
+# use_cache=False отключает кэш ответов модели, когда нужно максимальное разнообразие отзывов
+async def build_prompt(product_data, id_gen, rating_preference, gender_preference, model_name="gpt-4o-mini", persona=None, template=None, use_cache=True):
+    # Шаблон с разделами, зависящими только от товара, собирается один раз на генерацию
+    if template is None:
+        template = compile_prompt(product_data)
+    product_name = template.product_name
+    if persona is None:
+        persona = pp.who_am_i(gender_preference)
+    sex, profession, income, marital_status, children, hobby = persona
+
     reviewer_profile = pp.get_reviewer_profile(sex, profession, income, marital_status, children, hobby)
     
-    situation_prompt = pp.create_situation(sex, profession, income, marital_status, children, hobby, product_info)
-    situation_description = await get_model_responses(situation_prompt, model_name)
-    current_situation = await parse_scenarios(situation_description)
+    if scenario_pool is None:
+        situation_prompt = template.situation_prompt(sex, profession, income, marital_status, children, hobby)
+        # Промпт сценариев зависит только от товара и профиля покупателя, поэтому чаще всего повторяется
+        cache_situation = use_cache and COMPLETION_CACHE in ('situations', 'all')
+        situation_description = await get_model_responses(situation_prompt, model_name, use_cache=cache_situation)
+        current_situation = await parse_scenarios(situation_description)
+    else:
+        # Один ответ модели с 10 сценариями обслуживает несколько отзывов о товаре для покупателей из одного кластера,
+        # поэтому промпт содержит только поля кластера. Когда пул пуст, ответ может быть взят из кэша:
+        # пул не добавляет повторно сценарии уже сохраненного ответа
+        cluster = pp.persona_cluster(sex, profession, income, marital_status, children, hobby)
+        situation_prompt = template.cluster_situation_prompt(sex, profession, income, marital_status, children, hobby)
+        cache_situation = use_cache and COMPLETION_CACHE in ('situations', 'all')
+        current_situation = await scenario_pool.take(
+            product_data['идентификатор'], cluster, lambda: get_model_responses(situation_prompt, model_name, use_cache=cache_situation))
     situation = pp.get_situation(current_situation, product_name)
     
-    additionally = pp.get_additionally()
-    review_type, rating = pp.get_review_type(product_name,rating_preference)
-    
-    grammar_instruct = pp.get_grammar_instruct()
-    facts = pp.get_facts(product_name)
+    review_type, rating = pp.get_review_type(product_name, rating_preference)
 
-    complete_prompt = f"{task_descr}{product_charact}{review_prescription}{reviewer_profile}{situation}{additionally}{review_type}{grammar_instruct}{facts}"
+    complete_prompt = template.render(reviewer_profile, situation, review_type, pp.use_emoji())
     
     # Записываем данные о генерации
     context_data = {
@@ -117,24 +261,81 @@ async def build_prompt(product_id, id_gen, rating_preference, gender_preference,
     
     return complete_prompt, context_data
 
-# Функция генерации отзывов
-async def generate_reviews(product_id, id_gen, rating_preference, gender_preference, num_reviews, model_name, format_type):
+# Функция генерации одного отзыва: профиль покупателя -> ситуация -> итоговый промпт -> отзыв
+async def generate_review(product_data, id_gen, rating_preference, gender_preference, model_name, persona=None, template=None, use_cache=True):
+    complete_prompt, context_data = await build_prompt(product_data, id_gen, rating_preference, gender_preference, model_name, persona, template, use_cache)
+    review = await get_model_responses(complete_prompt, model_name, use_cache=use_cache and COMPLETION_CACHE == 'all')
+    return review, context_data
+
+# Функция потоковой генерации отзывов: отзывы выдаются по мере готовности в виде (номер профиля, отзыв, данные о генерации)
+async def stream_reviews(product_data, id_gen, rating_preference, gender_preference, model_name, personas, use_cache=True):
+    # Каждый отзыв проходит все этапы независимо от остальных, поэтому первый отзыв
+    # готов через время генерации одного отзыва, а не всей генерации
+    template = compile_prompt(product_data)
+    started = time.perf_counter()
+
+    async def indexed_review(index, persona):
+        review, context_data = await generate_review(product_data, id_gen, rating_preference, gender_preference, model_name, persona, template, use_cache)
+        return index, review, context_data
+
+    tasks = [asyncio.create_task(indexed_review(index, persona)) for index, persona in enumerate(personas)]
+    try:
+        for number, next_review in enumerate(asyncio.as_completed(tasks)):
+            result = await next_review
+            if number == 0:
+                metrics.observe('first_review_seconds', time.perf_counter() - started)
+            yield result
+    finally:
+        # При ошибке или досрочном завершении потребителем оставшиеся запросы отменяются
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# Функция генерации отзывов (progress(готово, всего) вызывается после каждого готового отзыва)
+async def generate_reviews(product_id, id_gen, rating_preference, gender_preference, num_reviews, model_name, format_type, product_data=None, seed=None, progress=None, use_cache=True):
+    rows = await generate_review_rows(product_id, id_gen, rating_preference, gender_preference, num_reviews, model_name, product_data, seed, progress, use_cache)
+    if rows is None:
+        return None
+    return export_rows(rows, format_type)
+
+# Функция генерации отзывов с записью в бд (возвращает строки для выгрузки в файл или None, если товар не найден)
+# raise_save_errors=True - ошибка записи отзывов в бд передается вызывающему
+async def generate_review_rows(product_id, id_gen, rating_preference, gender_preference, num_reviews, model_name, product_data=None, seed=None, progress=None, use_cache=True,
+                               raise_save_errors=False):
     
     if_windows()
+    metrics.inc('generation_jobs')
     
-    prompts_and_contexts = [await build_prompt(product_id, id_gen, rating_preference, gender_preference, model_name) for _ in range(num_reviews)]
-    prompts = [item[0] for item in prompts_and_contexts]
-    context_datas = [item[1] for item in prompts_and_contexts]
-
-    reviews = await asyncio.gather(*(get_model_responses(prompt, model_name) for prompt in prompts))
-    num_review = 0
+    # Карточка товара запрашивается один раз на всю генерацию и переиспользуется для каждого отзыва
+    if product_data is None:
+        product_data = await get_product_info(product_id)
+        if not product_data:
+            print(f"Не удалось получить данные о товаре {product_id}")
+            return None
+    else:
+        metrics.inc('product_snapshots_reused')
+    
+    # Профили покупателей для всех отзывов выбираются сразу (при заданном seed - воспроизводимо)
+    personas = pp.sample_personas(num_reviews, gender_preference, seed)
+    
+    results = [None] * num_reviews
+    done = 0
+    with metrics.timer('generation_seconds'):
+        async for index, review, context_data in stream_reviews(product_data, id_gen, rating_preference, gender_preference, model_name, personas, use_cache):
+            results[index] = (review, context_data)
+            done += 1
+            if progress is not None:
+                try:
+                    await progress(done, num_reviews)
+                except Exception as e:
+                    print(f"Ошибка при обновлении прогресса генерации: {e}")
     
     all_new_rows = []
+    review_records = []
 
-    # Записываем все отзывы в бд
-    for context_data, review in zip(context_datas, reviews):
-        num_review += 1
-        await save_review(
+    # Номера отзывов соответствуют порядку профилей, а не порядку получения ответов
+    for num_review, (review, context_data) in enumerate(results, start=1):
+        review_records.append((
             context_data['id_gen'],
             num_review,
             review,
@@ -145,7 +346,7 @@ async def generate_reviews(product_id, id_gen, rating_preference, gender_prefere
             context_data['marital_status'],
             context_data['children'],
             context_data['hobby']
-        )
+        ))
         
         all_new_rows.append({
             'id_gen': context_data['id_gen'],
@@ -156,52 +357,32 @@ async def generate_reviews(product_id, id_gen, rating_preference, gender_prefere
             'sex': context_data['sex']
         })
     
-    reviews_df = pd.DataFrame(all_new_rows)
+    # Записываем все отзывы генерации в бд одной транзакцией
+    await save_reviews(review_records, raise_errors=raise_save_errors)
     
-    if format_type == 'csv':
-        output = io.StringIO()
-        reviews_df.to_csv(output, index=False)
-        output.seek(0)
-        return output
-        
-    elif format_type == 'json':
-        output = io.StringIO()
-        reviews_df.to_json(output, orient='records', force_ascii=False)
-        output.seek(0)
-        return output
-        
-    elif format_type == 'xml':
-        root = ET.Element("Reviews")
-        for _, row in reviews_df.iterrows():
-            review_element = ET.SubElement(root, "Review")
-            for col in reviews_df.columns:
-                child = ET.SubElement(review_element, col)
-                child.text = str(row[col])
-        xml_string = ET.tostring(root, encoding='unicode', method='xml')
-        output = io.BytesIO()
-        output.write(xml_string.encode('utf-8'))  
-        output.seek(0)
-        return output
-        
-    elif format_type == 'xlsx':
-        output = io.BytesIO()
-        reviews_df.to_excel(output, index=False)
-        output.seek(0)
-        return output
+    return all_new_rows
 
 # Функция добавления записей об отзывах в бд
 async def save_review(id_gen, num_review, review, rating, current_situation, sex, profession, marital_status, children, hobby):
+    await save_reviews([(id_gen, num_review, review, rating, current_situation, sex, profession, marital_status, children, hobby)])
+
+# Функция добавления сразу нескольких отзывов в бд (одна транзакция и один commit)
+# Уже записанные отзывы (id_gen, num_review) не перезаписываются, поэтому повторная запись безопасна
+# raise_errors=True - ошибка записи передается вызывающему (например, чтобы не отмечать генерацию выполненной)
+async def save_reviews(review_records, raise_errors=False):
+    if not review_records:
+        return
     try:
-        async with aiosqlite.connect(DB_PATH) as db: 
-            await db.execute("""
-                INSERT INTO reviews (id_gen, num_review, review, rating, current_situation, sex, profession, marital_status, children, hobby) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (id_gen, num_review, review, rating, current_situation, sex, profession, marital_status, children, hobby))
-            await db.commit()
+        await storage.write_many("""
+            INSERT OR IGNORE INTO reviews (id_gen, num_review, review, rating, current_situation, sex, profession, marital_status, children, hobby) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, review_records)
     except Exception as e:
-        print(f"Произошла ошибка при сохранении отзыва: {e}")
+        print(f"Произошла ошибка при сохранении отзывов: {e}")
+        if raise_errors:
+            raise
 
 # Установка политики обработки цикла событий для Windows
 def if_windows():
     if sys.platform == 'win32':
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
\ No newline at end of file
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
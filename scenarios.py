@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict, deque
+import metrics
+import storage
+
+# Сценарий, который используется, если из ответа модели не удалось извлечь ни одного сценария
+FALLBACK_SCENARIO = "Придумай сценарий сам"
+
+# Интервал очистки пула в памяти от просроченных сценариев и неиспользуемых ключей, сек.
+PRUNE_INTERVAL = 60
+
+# Начала строк с номерами сценариев ("1." ... "10.")
+SCENARIO_PREFIXES = tuple(f"{i}." for i in range(1, 11))
+
+def parse_all_scenarios(data):
+    """Функция для извлечения всех пронумерованных сценариев из ответа модели."""
+
+    scenarios = {}
+    current_key = None
+    current_text = []
+
+    for line in data.split('\n'):
+        if line.startswith(SCENARIO_PREFIXES):
+            if current_key:
+                scenarios[current_key] = ' '.join(current_text).strip()
+            current_text = []
+            current_key = line.split('.')[0]
+            current_text.append(line[len(current_key) + 2:])
+        elif current_key:
+            current_text.append(line)
+
+    if current_key:
+        scenarios[current_key] = ' '.join(current_text).strip()
+
+    return [scenario for scenario in scenarios.values() if scenario]
+
+class ScenarioPool:
+    """Пул неиспользованных сценариев покупки для пар (товар, кластер покупателей).
+
+    Модель за один запрос придумывает 10 сценариев, а для отзыва нужен один, поэтому
+    остальные сохраняются в пул и выдаются следующим отзывам того же товара
+    для покупателей из того же кластера. Если persist=True, пул хранится в базе данных
+    и общий для всех генераций (и процессов) по одному артикулу. Сценарии старше ttl секунд
+    не выдаются, чтобы после изменения карточки товара пул заполнялся новыми сценариями.
+    Ожидание ответа модели ограничено produce_timeout секундами (затем используется FALLBACK_SCENARIO).
+    """
+
+    def __init__(self, persist=True, ttl=24 * 3600, produce_timeout=120):
+        self.persist = persist
+        self.ttl = ttl
+        self.produce_timeout = produce_timeout
+        self._pools = defaultdict(deque)  # (товар, кластер) -> deque из (id_scenario, сценарий, срок годности)
+        self._locks = defaultdict(asyncio.Lock)
+        self._users = Counter()  # (товар, кластер) -> число вызовов take, использующих блокировку ключа
+        self._stored_responses = {}  # (товар, кластер) -> (хэш ответа модели, сценарии которого добавлены в пул, срок годности)
+        self._pruned_at = time.monotonic()
+
+    async def take(self, product_id, cluster, produce):
+        """Асинхронный метод для получения сценария: из пула, а если он пуст - из нового ответа модели produce()."""
+
+        key = (int(product_id), cluster)
+        self._users[key] += 1
+        try:
+            # Пока для ключа выполняется запрос к модели, остальные отзывы ждут его сценариев
+            async with self._locks[key]:
+                scenario = await self._take_stored(key)
+                if scenario is None:
+                    scenario = await self._take_produced(key, produce)
+                else:
+                    metrics.inc('scenario_completions_saved')
+        finally:
+            self._release(key)
+        metrics.inc('scenarios_served')
+        return scenario
+
+    async def _take_produced(self, key, produce):
+        metrics.inc('scenario_completions')
+        try:
+            response = await asyncio.wait_for(produce(), self.produce_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc('scenario_completion_timeouts')
+            print(f"Сценарии для товара {key[0]} не получены за {self.produce_timeout} сек.")
+            return FALLBACK_SCENARIO
+        scenarios = parse_all_scenarios(response)
+        random.shuffle(scenarios)
+        scenario = scenarios.pop() if scenarios else FALLBACK_SCENARIO
+        # Тот же ответ (например, из кэша ответов модели) уже был добавлен в пул: его сценарии не дублируются
+        stored = self._stored_responses.get(key)
+        if stored is not None and stored[0] == hash(response) and stored[1] > time.time():
+            metrics.inc('scenario_responses_repeated')
+        else:
+            self._stored_responses[key] = (hash(response), time.time() + self.ttl)
+            await self._store(key, scenarios)
+        return scenario
+
+    def _release(self, key):
+        # Блокировка и пустая очередь ключа удаляются, когда ими больше никто не пользуется
+        self._users[key] -= 1
+        if not self._users[key]:
+            del self._users[key]
+            del self._locks[key]
+            if not self._pools.get(key):
+                self._pools.pop(key, None)
+        now = time.monotonic()
+        if now - self._pruned_at >= PRUNE_INTERVAL:
+            self._pruned_at = now
+            self._prune()
+
+    def _prune(self):
+        """Метод удаляет просроченные сценарии из пула в памяти и ключи, по которым ничего не осталось."""
+
+        now = time.time()
+        for key in [key for key in self._pools if key not in self._users]:
+            pool = deque(item for item in self._pools[key] if item[2] > now)
+            metrics.inc('scenarios_expired', len(self._pools[key]) - len(pool))
+            if pool:
+                self._pools[key] = pool
+            else:
+                del self._pools[key]
+        for key in [key for key, (_, expires_at) in self._stored_responses.items() if expires_at <= now]:
+            del self._stored_responses[key]
+
+    def savings(self):
+        """Метод возвращает долю отзывов, для которых не понадобился отдельный запрос сценариев к модели."""
+
+        served = metrics.counters['scenarios_served']
+        return metrics.counters['scenario_completions_saved'] / served if served else 0.0
+
+    async def _take_stored(self, key):
+        pool = self._pools[key]
+        if not pool and self.persist:
+            # Возраст сценария считается в базе данных, так как created_at хранится в местном времени
+            rows = await storage.fetchall("""
+                SELECT id_scenario, scenario, (julianday('now', 'localtime') - julianday(created_at)) * 86400 FROM scenario_pool
+                WHERE id_product = ? AND cluster = ? AND created_at >= datetime('now', 'localtime', ?) LIMIT 20
+            """, (*key, f'-{self.ttl} seconds'))
+            now = time.time()
+            pool.extend((id_scenario, scenario, now - age + self.ttl) for id_scenario, scenario, age in rows)
+        while pool:
+            id_scenario, scenario, expires_at = pool.popleft()
+            if expires_at <= time.time():
+                metrics.inc('scenarios_expired')
+                continue
+            if not self.persist:
+                return scenario
+            # Сценарий мог забрать другой процесс, тогда удаление ничего не изменит
+            result = await storage.write("DELETE FROM scenario_pool WHERE id_scenario = ?", (id_scenario,))
+            if result.rowcount:
+                return scenario
+        return None
+
+    async def _store(self, key, scenarios):
+        expires_at = time.time() + self.ttl
+        if not self.persist:
+            self._pools[key].extend((None, scenario, expires_at) for scenario in scenarios)
+            return
+        # Вместе с новыми сценариями удаляются устаревшие сценарии этого товара и кластера
+        await storage.write("DELETE FROM scenario_pool WHERE id_product = ? AND cluster = ? AND created_at < datetime('now', 'localtime', ?)",
+                            (*key, f'-{self.ttl} seconds'))
+        results = await asyncio.gather(*(
+            storage.write("INSERT INTO scenario_pool (id_product, cluster, scenario) VALUES (?, ?, ?)", (*key, scenario))
+            for scenario in scenarios
+        ))
+        self._pools[key].extend((result.lastrowid, scenario, expires_at) for result, scenario in zip(results, scenarios))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from collections import deque
+import metrics
+
+class QueueFull(Exception):
+    """Исключение, возникающее при переполнении очереди заданий на генерацию."""
+
+class GenerationScheduler:
+    """Ограниченная очередь заданий на генерацию с фиксированным числом обработчиков.
+
+    У каждого пользователя одновременно выполняется не более одного задания,
+    остальные его задания ждут в очереди, не занимая обработчики.
+    """
+
+    def __init__(self, num_workers=4, max_queue=100):
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self._pending = deque()  # (user_id, job, args, enqueued_at)
+        self._active_users = set()
+        self._condition = None
+        self._workers = []
+        self._closing = False
+
+    def start(self):
+        """Метод для запуска обработчиков очереди (вызывается при запуске бота)."""
+
+        if self._workers:
+            return
+        self._condition = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        """Асинхронный метод для остановки обработчиков очереди."""
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def drain(self, timeout=None):
+        """Асинхронный метод для плавной остановки: новые задания не принимаются,
+        уже принятые выполняются (не дольше timeout секунд), после чего обработчики останавливаются."""
+
+        self._closing = True
+        if self._condition is not None:
+            async with self._condition:
+                try:
+                    await asyncio.wait_for(self._condition.wait_for(lambda: not self._pending and not self._active_users), timeout)
+                except asyncio.TimeoutError:
+                    print(f"Не дождались завершения генераций: в очереди {len(self._pending)}, выполняется {len(self._active_users)}")
+        await self.stop()
+
+    async def submit(self, user_id, job, *args):
+        """Асинхронный метод для постановки задания в очередь.
+
+        Возвращает 0, если задание начнет выполняться сразу, иначе позицию в очереди.
+        При переполнении очереди (или во время остановки) возбуждает QueueFull.
+        """
+
+        if self._condition is None:
+            self.start()
+        async with self._condition:
+            if self._closing or len(self._pending) >= self.max_queue:
+                metrics.inc('queue_rejected')
+                raise QueueFull()
+            self._pending.append((user_id, job, args, time.monotonic()))
+            metrics.inc('queue_submitted')
+            metrics.observe('queue_depth', len(self._pending))
+            position = self.position(user_id)
+            self._condition.notify()
+        return position
+
+    def position(self, user_id):
+        """Метод возвращает позицию последнего задания пользователя в очереди (0 - выполняется без ожидания)."""
+
+        # Проходим очередь в том же порядке, в котором ее разбирают обработчики
+        idle_workers = self.num_workers - len(self._active_users)
+        busy_users = set(self._active_users)
+        position = 0
+        for index, (queued_user, *_) in enumerate(self._pending, start=1):
+            starts_now = idle_workers > 0 and queued_user not in busy_users
+            if starts_now:
+                idle_workers -= 1
+                busy_users.add(queued_user)
+            if queued_user == user_id:
+                position = 0 if starts_now else index
+        return position
+
+    def depth(self):
+        return len(self._pending)
+
+    def active(self):
+        return len(self._active_users)
+
+    def _next_job(self):
+        # Берем первое задание пользователя, у которого сейчас нет выполняемых заданий
+        for index, item in enumerate(self._pending):
+            if item[0] not in self._active_users:
+                del self._pending[index]
+                return item
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                item = self._next_job()
+                while item is None:
+                    await self._condition.wait()
+                    item = self._next_job()
+                user_id, job, args, enqueued_at = item
+                self._active_users.add(user_id)
+
+            metrics.observe('queue_wait_seconds', time.monotonic() - enqueued_at)
+            try:
+                await job(*args)
+                metrics.inc('jobs_completed')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.inc('jobs_failed')
+                print(f"Ошибка при выполнении генерации: {e}")
+            finally:
+                async with self._condition:
+                    self._active_users.discard(user_id)
+                    self._condition.notify_all()
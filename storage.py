@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+from collections import namedtuple
+from contextlib import asynccontextmanager
+import aiosqlite
+from dotenv import load_dotenv
+import metrics
+from database import migrate
+
+load_dotenv()
+
+DB_PATH = os.getenv('DB_PATH')
+
+# Число соединений для чтения и максимальное число запросов, фиксируемых одним commit
+DB_READERS = int(os.getenv('DB_READERS', 4))
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 256))
+
+# Настройки SQLite для каждого соединения: журнал WAL позволяет читать параллельно с записью
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+)
+
+# Результат запроса на запись
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+
+class Database:
+    """Соединения с базой данных, открываемые один раз при запуске приложения.
+
+    Чтение выполняется через пул соединений, а все запросы на запись передаются
+    единственной задаче-писателю, которая выполняет накопившиеся запросы
+    и фиксирует их одним commit (групповая фиксация).
+    """
+
+    def __init__(self, path, readers=DB_READERS, batch_size=DB_BATCH_SIZE):
+        self.path = path
+        self.readers = readers
+        self.batch_size = batch_size
+        self._writer_conn = None
+        self._reader_pool = None
+        self._reader_conns = []
+        self._queue = None
+        self._writer_task = None
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def open(self):
+        """Асинхронный метод для открытия соединений и запуска задачи-писателя."""
+
+        self._writer_conn = await self._connect()
+        self._reader_pool = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = await self._connect()
+            self._reader_conns.append(conn)
+            self._reader_pool.put_nowait(conn)
+        self._queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def close(self):
+        """Асинхронный метод, дожидающийся выполнения всех запросов на запись и закрывающий соединения."""
+
+        if self._writer_task is not None:
+            await self._queue.put(None)
+            await self._writer_task
+            self._writer_task = None
+        for conn in [self._writer_conn, *self._reader_conns]:
+            if conn is not None:
+                await conn.close()
+        self._writer_conn = None
+        self._reader_conns = []
+
+    async def write(self, sql, params=()):
+        """Асинхронный метод для выполнения запроса на запись (возвращает WriteResult после commit)."""
+
+        return await self._submit(sql, params, False)
+
+    async def write_many(self, sql, seq_of_params):
+        """Асинхронный метод для выполнения запроса на запись для каждого набора параметров."""
+
+        return await self._submit(sql, list(seq_of_params), True)
+
+    async def _submit(self, sql, params, many):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((sql, params, many, future))
+        return await future
+
+    @asynccontextmanager
+    async def reader(self):
+        """Асинхронный контекстный менеджер, выдающий соединение для чтения из пула."""
+
+        conn = await self._reader_pool.get()
+        try:
+            yield conn
+        finally:
+            self._reader_pool.put_nowait(conn)
+
+    async def fetchone(self, sql, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def _writer(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._commit_batch(batch)
+            except Exception as e:
+                print(f"Ошибка при записи в базу данных: {e}")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _commit_batch(self, batch):
+        conn = self._writer_conn
+        results = []
+        rows = 0
+        # Явное начало транзакции: без него RELEASE первой точки сохранения сам фиксировал бы транзакцию
+        if not conn.in_transaction:
+            await conn.execute("BEGIN")
+        for sql, params, many, future in batch:
+            # Каждый запрос выполняется в своей точке сохранения: при ошибке откатывается весь запрос
+            # (для write_many - все наборы параметров), остальные запросы пачки фиксируются
+            await conn.execute("SAVEPOINT batch_write")
+            try:
+                if many:
+                    cursor = await conn.executemany(sql, params)
+                else:
+                    cursor = await conn.execute(sql, params)
+                results.append((future, WriteResult(cursor.lastrowid, cursor.rowcount)))
+                rows += max(cursor.rowcount, 0)
+                await cursor.close()
+            except Exception as e:
+                await conn.execute("ROLLBACK TO batch_write")
+                results.append((future, e))
+            await conn.execute("RELEASE batch_write")
+
+        try:
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+        metrics.inc('db_commits')
+        metrics.inc('db_rows_written', rows)
+        metrics.observe('db_batch_size', len(batch))
+        for future, result in results:
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+# Общие для приложения соединения с базой данных
+_db = None
+_open_lock = None
+
+async def open_db(path=DB_PATH):
+    """Асинхронная функция для открытия базы данных (вызывается при запуске приложения, повторный вызов ничего не делает)."""
+
+    global _db, _open_lock
+    if _open_lock is None:
+        _open_lock = asyncio.Lock()
+    async with _open_lock:
+        if _db is None:
+            # Перед открытием соединений применяем недостающие миграции схемы
+            await asyncio.to_thread(migrate, path)
+            db = Database(path)
+            await db.open()
+            _db = db
+    return _db
+
+async def close_db():
+    """Асинхронная функция для закрытия базы данных при остановке приложения."""
+
+    global _db
+    if _db is not None:
+        db, _db = _db, None
+        await db.close()
+
+async def write(sql, params=()):
+    return await (await open_db()).write(sql, params)
+
+async def write_many(sql, seq_of_params):
+    return await (await open_db()).write_many(sql, seq_of_params)
+
+async def fetchone(sql, params=()):
+    return await (await open_db()).fetchone(sql, params)
+
+async def fetchall(sql, params=()):
+    return await (await open_db()).fetchall(sql, params)
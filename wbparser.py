@@ -2,13 +2,55 @@
 
 import aiohttp  
 import asyncio  
-import aiosqlite
+import hashlib
+import json
 import os
+import time
 from dotenv import load_dotenv
+import metrics
+import storage
+from cache import ProductCache
 
 load_dotenv()
 
-DB_PATH = os.getenv('DB_PATH')
+# Ограничения пула соединений с серверами Wildberries
+WB_POOL_SIZE = int(os.getenv('WB_POOL_SIZE', 100))
+WB_POOL_PER_HOST = int(os.getenv('WB_POOL_PER_HOST', 10))
+
+# Независимые тайм-ауты запросов карточки товара и цены (в секундах)
+CARD_TIMEOUT = float(os.getenv('WB_CARD_TIMEOUT', 10))
+PRICE_TIMEOUT = float(os.getenv('WB_PRICE_TIMEOUT', 3))
+
+# Значение цены, если ее не удалось получить вовремя
+PRICE_UNKNOWN = 'Цена неизвестна'
+
+# Товары, уже записанные в базу данных (артикул -> название), чтобы не обращаться к бд повторно
+known_products = {}
+
+# Общая HTTP-сессия приложения (создается при запуске бота)
+_session = None
+
+async def open_session():
+    """Асинхронная функция для создания общей HTTP-сессии с пулом соединений, keep-alive и кэшем DNS."""
+    
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=WB_POOL_SIZE,
+            limit_per_host=WB_POOL_PER_HOST,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+    return _session
+
+async def close_session():
+    """Асинхронная функция для закрытия общей HTTP-сессии при остановке приложения."""
+    
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
 
 async def get_card_url(id):
     """Асинхронная функция для определения URL адресов по артикулу."""
@@ -83,25 +125,42 @@ async def get_card_info(session, url_1, url_2):
     """Асинхронная функция для получения информации о карточке товара и его цене."""
     
     headers=get_headers()
-    async with session.get(url=url_1, headers=headers) as response:
-        response_json = await response.json()
-    price = await get_price(session, url_2, headers)
+    # Запросы карточки и цены не зависят друг от друга, поэтому выполняются одновременно
+    response_json, price = await asyncio.gather(
+        get_card(session, url_1, headers),
+        get_price(session, url_2, headers),
+    )
     
     return response_json, price
 
+async def get_card(session, url, headers):
+    """Асинхронная функция для получения json-файла с описанием и характеристиками товара."""
+    
+    async with session.get(url=url, headers=headers, timeout=aiohttp.ClientTimeout(total=CARD_TIMEOUT)) as response:
+        # Карточки нет (товар удален): возвращаем пустой ответ, остальные ошибки сервера возбуждают исключение
+        if response.status == 404:
+            return {}
+        response.raise_for_status()
+        return await response.json()
+
 async def get_price(session, url, headers):
-    """Асинхронная функция для получения цены товара."""
+    """Асинхронная функция для получения цены товара.
+    
+    Если сервер цен не ответил за PRICE_TIMEOUT секунд или вернул ошибку, 
+    возвращается PRICE_UNKNOWN, чтобы не задерживать получение карточки товара.
+    """
     
     try:
-        async with session.get(url=url, headers=headers) as url_resp:
+        async with session.get(url=url, headers=headers, timeout=aiohttp.ClientTimeout(total=PRICE_TIMEOUT)) as url_resp:
             data = await url_resp.json()
             data = data.get('data', {}).get('products', [])
             if data:
                 price_info = data[0]['sizes'][0]['price'].get('product')
                 if price_info is not None:
                     return price_info / 100
-    except:
-        return 'Цена неизвестна'
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, IndexError, AttributeError, TypeError):
+        metrics.inc('price_fetch_failures')
+    return PRICE_UNKNOWN
 
 def get_json_data(response, price):
     """Функция для формирования словаря с данными о товаре."""
@@ -140,32 +199,104 @@ def get_headers():
         'sec-ch-ua-platform': 'macOS',
     }
 
-async def get_product_info(id):
-    """Основная асинхронная функция для получения данных о товаре, и внесения их в базу данных."""
+async def get_product_info(id, use_cache=True):
+    """Основная асинхронная функция для получения данных о товаре (через кэш карточек товаров)."""
+    
+    if not use_cache:
+        return await fetch_product_info(str(id))
+    return await product_cache.get(str(id))
+
+async def register_product(id, product_name):
+    """Асинхронная функция для записи товара в базу данных (или обновления его названия)."""
+    
+    if known_products.get(id) == product_name:
+        return
+    await storage.write("""
+        INSERT INTO products (id_product, product_name) VALUES (?, ?)
+        ON CONFLICT(id_product) DO UPDATE SET product_name = excluded.product_name WHERE product_name IS NOT excluded.product_name
+    """, (id, product_name))
+    known_products[id] = product_name
+
+async def load_snapshot(id):
+    """Асинхронная функция для чтения сохраненной в базе данных карточки товара."""
     
-    session = aiohttp.ClientSession()
     try:
-        link, price_link = await get_card_url(id)
+        row = await storage.fetchone("SELECT data, fetched_at FROM product_snapshots WHERE id_product = ?", (id,))
+    except Exception as e:
+        print(f"Ошибка при чтении карточки товара из базы данных: {e}")
+        return None
+    if row is None:
+        return None
+    return json.loads(row[0]), row[1]
+
+async def save_snapshot(id, product_data, fetched_at=None):
+    """Асинхронная функция для сохранения карточки товара в базу данных в виде компактного json.
+    
+    fetched_at - время получения карточки (при обновлении только цены остается прежним),
+    product_data=None удаляет сохраненную карточку (товар больше не найден).
+    """
+    
+    try:
+        if product_data is None:
+            await storage.write("DELETE FROM product_snapshots WHERE id_product = ?", (id,))
+            return
+        data = json.dumps(product_data, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+        content_hash = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        await storage.write("""
+            INSERT INTO product_snapshots (id_product, data, content_hash, fetched_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(id_product) DO UPDATE SET data = excluded.data, content_hash = excluded.content_hash, fetched_at = excluded.fetched_at
+        """, (id, data, content_hash, time.time() if fetched_at is None else fetched_at))
+    except Exception as e:
+        print(f"Ошибка при сохранении карточки товара в базу данных: {e}")
+
+async def fetch_price(id):
+    """Асинхронная функция для обновления только цены товара (используется кэшем)."""
+    
+    session = await open_session()
+    link, price_link = await get_card_url(id)
+    price = await get_price(session, price_link, get_headers())
+    return None if price == PRICE_UNKNOWN else price
+
+async def load_product_info(id):
+    """Асинхронная функция для загрузки данных о товаре с Wildberries, и внесения их в базу данных.
+    
+    Возвращает None, если товар не найден; ошибки запросов не перехватываются,
+    чтобы кэш карточек товаров мог отличить удаленный товар от временного сбоя.
+    """
+    
+    metrics.inc('product_fetches')
+    session = await open_session()
+    link, price_link = await get_card_url(id)
+    with metrics.timer('wb_lookup_seconds'):
         response, price = await get_card_info(session, link, price_link)
-        if response.get('nm_id', None) is None: 
-            return None
-        product_data = get_json_data(response, price)
-    
-        async with aiosqlite.connect(DB_PATH) as db:
-            # Проверяем, есть товар в базе данных
-            cursor = await db.execute("SELECT id_product FROM products WHERE id_product = ?", (product_data['идентификатор'],))
-            exists = await cursor.fetchone()
-            if not exists:
-                # Если товара нет в бд, записываем его
-                await db.execute("INSERT INTO products (id_product, product_name) VALUES (?, ?)", 
-                                 (product_data['идентификатор'], product_data['наименование_товара']))
-                await db.commit()
-                
-        return product_data
+    if response.get('nm_id', None) is None: 
+        return None
+    product_data = get_json_data(response, price)
+
+    await register_product(product_data['идентификатор'], product_data['наименование_товара'])
+            
+    return product_data
+
+async def fetch_product_info(id):
+    """Асинхронная функция для получения данных о товаре без кэша (при ошибке возвращает None)."""
+    
+    try:
+        return await load_product_info(id)
     
     # Если произошла ошибка, выводим её
     except Exception as e:
         print(f"Ошибка при получении данных: {e}")
         return None
-    finally:
-        await session.close()
\ No newline at end of file
+
+# Кэш карточек товаров: карточка хранится долго, цена - недолго
+product_cache = ProductCache(
+    load_product_info,
+    fetch_price,
+    price_key='цена_в_рублях',
+    maxsize=int(os.getenv('PRODUCT_CACHE_SIZE', 1024)),
+    card_ttl=int(os.getenv('PRODUCT_CARD_TTL', 6 * 3600)),
+    price_ttl=int(os.getenv('PRODUCT_PRICE_TTL', 600)),
+    stale_ttl=int(os.getenv('PRODUCT_STALE_TTL', 24 * 3600)),
+    snapshot_loader=load_snapshot,
+    snapshot_saver=save_snapshot,
+)
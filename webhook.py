@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hmac
+import inspect
+import os
+import signal
+from aiohttp import web
+from dotenv import load_dotenv
+from telegram import Update
+import metrics
+
+load_dotenv()
+
+# Адрес, по которому Telegram отправляет обновления, и секрет для проверки их подлинности
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+
+# Адрес и порт локального HTTP-сервера
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+
+# Заголовок, в котором Telegram передает секрет, заданный при установке вебхука
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+async def handle_update(request):
+    """Обработчик запроса от Telegram: обновление передается в очередь приложения, ответ отправляется сразу."""
+
+    # Без заданного секрета обновления не принимаются; сравнение за постоянное время не раскрывает секрет по времени ответа
+    secret = request.headers.get(SECRET_HEADER, '')
+    if not WEBHOOK_SECRET or not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        metrics.inc('webhook_rejected')
+        return web.Response(status=403)
+    if not request.app['state']['ready']:
+        # Telegram повторит отправку обновления позже (например, уже другому экземпляру бота)
+        return web.Response(status=503)
+    try:
+        data = await request.json()
+    except ValueError:
+        metrics.inc('webhook_rejected')
+        return web.Response(status=400)
+
+    application = request.app['application']
+    try:
+        update = Update.de_json(data, application.bot)
+    except Exception as e:
+        # Обновление пришло от Telegram (секрет верный), поэтому отвечаем 200: иначе Telegram повторял бы его отправку
+        print(f"Не удалось разобрать обновление от Telegram: {e}")
+        metrics.inc('webhook_invalid_updates')
+        return web.Response()
+    await application.update_queue.put(update)
+    metrics.inc('webhook_updates')
+    return web.Response()
+
+async def handle_health(request):
+    """Проверка работоспособности: процесс запущен и отвечает на запросы."""
+
+    return web.json_response({'status': 'ok'})
+
+async def handle_ready(request):
+    """Проверка готовности: бот запущен, принимает обновления и не находится в процессе остановки."""
+
+    ready = request.app['state']['ready']
+    # status() может быть обычной или асинхронной функцией (например, длина очереди в бд)
+    extra = request.app['status']()
+    if inspect.isawaitable(extra):
+        extra = await extra
+    status = {'ready': ready, **extra}
+    return web.json_response(status, status=200 if ready else 503)
+
+def create_web_app(application, status=dict):
+    """Функция создает HTTP-сервер вебхука с проверками /healthz и /readyz (status() - дополнительные данные для /readyz)."""
+
+    web_app = web.Application()
+    web_app['application'] = application
+    web_app['status'] = status
+    # Изменяемое состояние сервера (признак готовности меняется уже после его запуска)
+    web_app['state'] = {'ready': False}
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    web_app.router.add_get('/healthz', handle_health)
+    web_app.router.add_get('/readyz', handle_ready)
+    return web_app
+
+def wait_for_stop_signal():
+    """Функция возвращает событие, которое устанавливается при получении SIGINT или SIGTERM."""
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # На Windows обработчики сигналов в цикле событий не поддерживаются, остается KeyboardInterrupt
+            pass
+    return stop_event
+
+async def run_webhook(application, on_startup, on_stop, on_shutdown, status=dict):
+    """Асинхронная функция запуска бота в режиме вебхука (вместо run_polling).
+
+    Порядок остановки: /readyz начинает возвращать 503 и новые обновления не принимаются,
+    приложение обрабатывает уже полученные обновления, on_stop дожидается выполнения
+    генераций, после чего освобождаются ресурсы и останавливается HTTP-сервер.
+    """
+
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise SystemExit("Для режима webhook нужно задать переменные окружения WEBHOOK_URL и WEBHOOK_SECRET")
+
+    web_app = create_web_app(application, status)
+    runner = web.AppRunner(web_app)
+    stop_event = wait_for_stop_signal()
+    # Запуск тоже выполняется внутри try: если он не удался (например, порт занят), ресурсы все равно освобождаются
+    try:
+        await runner.setup()
+        await application.initialize()
+        await on_startup(application)
+        await application.start()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        web_app['state']['ready'] = True
+        print(f"Бот запущен в режиме webhook на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await stop_event.wait()
+    finally:
+        web_app['state']['ready'] = False
+        if application.running:
+            await application.stop()
+        await on_stop(application)
+        await application.shutdown()
+        await on_shutdown(application)
+        await runner.cleanup()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import socket
+from dotenv import load_dotenv
+from telegram import Bot
+import storage
+from bot import register_generation, notify_generation_failed
+from jobqueue import DatabaseJobQueue
+from revgen import init_client, close_client, if_windows
+from wbparser import open_session, close_session
+from webhook import wait_for_stop_signal
+
+# Загрузка переменных окружения
+load_dotenv()
+
+TG_API_TOKEN = os.getenv('TG_API_TOKEN')
+DB_PATH = os.getenv('DB_PATH')
+
+# Число одновременно выполняемых генераций в одном процессе-обработчике
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 4))
+
+# Как часто проверять очередь, если в ней нет заданий, сек.
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+
+# Как часто обработчик сообщает, что задание еще выполняется, сек.
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', 30))
+
+# Через сколько секунд без сигнала от обработчика задание считается зависшим и возвращается в очередь
+# (должно быть в несколько раз больше JOB_HEARTBEAT_INTERVAL)
+JOB_TIMEOUT = float(os.getenv('JOB_TIMEOUT', 300))
+
+# Ожидание следующей проверки очереди (прерывается сигналом остановки)
+async def sleep_until(stop_event, delay):
+    try:
+        await asyncio.wait_for(stop_event.wait(), delay)
+    except asyncio.TimeoutError:
+        pass
+
+# Периодический сигнал о том, что задание еще выполняется (чтобы долгую генерацию не вернули в очередь)
+async def keep_alive(job_queue, id_job):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            await job_queue.heartbeat(id_job)
+        except Exception as e:
+            print(f"Ошибка при обновлении состояния задания {id_job}: {e}")
+
+# Цикл обработки заданий: после сигнала остановки новое задание не берется, текущее доводится до конца
+async def work(job_queue, bot, worker_id, stop_event):
+    while not stop_event.is_set():
+        try:
+            job = await job_queue.claim(worker_id)
+        except Exception as e:
+            print(f"Ошибка при получении задания из очереди: {e}")
+            job = None
+        if job is None:
+            await sleep_until(stop_event, JOB_POLL_INTERVAL)
+            continue
+
+        id_job, user_id, args = job
+        heartbeat = asyncio.create_task(keep_alive(job_queue, id_job))
+        try:
+            await register_generation(bot, *args)
+        except Exception as e:
+            # Пользователь уже уведомлен об ошибке в register_generation
+            print(f"Ошибка при выполнении генерации {id_job}: {e}")
+            await job_queue.complete(id_job, str(e) or type(e).__name__)
+        else:
+            await job_queue.complete(id_job)
+        finally:
+            heartbeat.cancel()
+
+# Периодический возврат в очередь заданий, зависших после сбоя других обработчиков
+# (пользователи заданий, исчерпавших число попыток, получают уведомление об ошибке)
+async def requeue_stale(job_queue, bot, stop_event):
+    while not stop_event.is_set():
+        try:
+            for id_job, user_id, args in await job_queue.requeue_stale():
+                print(f"Генерация {id_job} не завершилась за отведенное время")
+                await notify_generation_failed(bot, args[0])
+        except Exception as e:
+            print(f"Ошибка при проверке зависших заданий: {e}")
+        await sleep_until(stop_event, min(60, JOB_TIMEOUT))
+
+async def main():
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    job_queue = DatabaseJobQueue(timeout=JOB_TIMEOUT)
+    stop_event = wait_for_stop_signal()
+
+    try:
+        await storage.open_db(DB_PATH)
+        await init_client()
+        await open_session()
+        async with Bot(TG_API_TOKEN) as bot:
+            print(f"Обработчик {worker_id} запущен ({WORKER_CONCURRENCY} генераций одновременно)")
+            await asyncio.gather(
+                requeue_stale(job_queue, bot, stop_event),
+                *(work(job_queue, bot, worker_id, stop_event) for _ in range(WORKER_CONCURRENCY)),
+            )
+    finally:
+        await close_client()
+        await close_session()
+        await storage.close_db()
+
+if __name__ == '__main__':
+
+    if_windows()
+    asyncio.run(main())